@@ -1,249 +1,305 @@
-"""Import Apple Events"""
-from Carbon import AppleEvents
-from Carbon import AE
-
-import Queue
-import struct
+"""Megaman X AI driven by a genetic algorithm"""
+import os
 import sys
 import time
-import urllib2
 
-from threading import Thread, Lock
-from pykeyboard import PyKeyboard
+from array import array
+from collections import deque
 
 from megaman_action import MegamanAction
 from megaman_ai_test import MegamanAIRunner
-
-import Quartz
+from megaman_archive import GenerationArchive, is_archive
+from megaman_cache import FitnessCache
+from megaman_checkpoint import RunnerCheckpointer
+from megaman_input import InputController
+from megaman_memory import LatencyHistogram, RamSnapshot
+from megaman_profiler import TickProfiler
+from megaman_savestates import PrefixCheckpoint, SaveStateStore
+from megaman_scheduler import ActionScheduler
+from megaman_telemetry import TelemetryLog
 
 # Memory offsets obtained from:
 # http://tasvideos.org/GameResources/SNES/MegaManX/RAMMap.html
 
-def clockms():
-    """Returns the amount of time the process has been running in milliseconds"""
-    return time.clock() * 1000
-
-def focuswindow(window):
-    """Focuses the provided window"""
-    if window is None:
-        pass
-    actevent = AE.AECreateAppleEvent('misc', 'actv', window,
-                                     AppleEvents.kAutoGenerateReturnID,
-                                     AppleEvents.kAnyTransactionID)
-    actevent.AESend(AppleEvents.kAEWaitReply, AppleEvents.kAENormalPriority,
-                    AppleEvents.kAEDefaultTimeout)
-
-def findwindow(bundleid):
-    """Finds a window identified by the provided bundle identifier"""
-    return AE.AECreateDesc(AppleEvents.typeApplicationBundleID, bundleid)
-
 class MegamanAI(object):
     """Class for running the Megaman AI simulation"""
 
-    REST = "http://localhost:1993/"
-    BSNES_BUNDLE_ID = "org.bsnes.bsnes-plus"
-    LEFT_ARROW = 0x7B
-    RIGHT_ARROW = 0x7C
-    F4_KEY = 0x76
     DESTINATION_POSITION = 7600
     MIN_POSITION = 100
     INITIAL_TESTS = 25
-
-    def __init__(self):
+    FPS = 30
+    RELOAD_TIMEOUT = 1.0
+    # Fraction of the selection pool's position a run may trail by, once
+    # PRUNE_GRACE seconds in, before it is ended early
+    PRUNE_MARGIN = 0.25
+    PRUNE_GRACE = 2.0
+    FITNESS_CACHE = "fitness_cache.json"
+    CHECKPOINT_DIRECTORY = "checkpoints"
+    KEYS = ('left', 'right', 'f4', 'a', 'z', 'x', 'c')
+    # Set to a file name to write a Chrome trace of the last frames on exit
+    PROFILE_TRACE = None
+    PROFILE_SECTIONS = ('tick', 'read', 'refresh', 'check_jumping', 'check_death',
+                        'check_stalled', 'check_min_pos', 'check_hopeless',
+                        'check_milestone', 'dispatch', 'flush', 'overshoot')
+
+    def __init__(self, backend, test_suite=None, telemetry=None):
         """Constructor"""
+        self.backend = backend
         # Create initial AI test suite
         self.prev_position = 0
         self.current_health = 0
-        self.relevant_update_time = time.time()
-        self.test_suite = MegamanAIRunner(self.INITIAL_TESTS, self.DESTINATION_POSITION)
-        if len(sys.argv) > 1:
-            # Attempt to import the provided filename
-            self.test_suite.import_tests(sys.argv[1])
-        self.current_ai_actions = list(self.test_suite.get_current_test().actions)
+        self.relevant_update_time = self.backend.clock()
+        self.test_suite = test_suite
+        self.telemetry = telemetry
+        self.checkpointer = None
+        if self.test_suite is None:
+            self.checkpointer = RunnerCheckpointer(self.CHECKPOINT_DIRECTORY)
+            # Without an explicit file, pick up from the newest checkpoint
+            state = self.checkpointer.latest() if len(sys.argv) <= 1 else None
+            # Keep appending to an archive we resume from, otherwise start a new one
+            archive_file = time.strftime("%Y-%m-%d_%H:%M:%S.mmxa", time.gmtime())
+            if len(sys.argv) > 1 and is_archive(sys.argv[1]):
+                archive_file = sys.argv[1]
+            elif state is not None and state['archive'] is not None:
+                archive_file = state['archive']
+            self.test_suite = MegamanAIRunner(self.INITIAL_TESTS, self.DESTINATION_POSITION,
+                                              FitnessCache(self.FITNESS_CACHE),
+                                              GenerationArchive(archive_file),
+                                              self.checkpointer,
+                                              prune_margin=self.PRUNE_MARGIN,
+                                              prune_grace=self.PRUNE_GRACE)
+            # Every run's telemetry is kept next to the archive
+            self.telemetry = TelemetryLog(os.path.splitext(archive_file)[0] + ".mmxt")
+            if len(sys.argv) > 1:
+                # Attempt to import the provided filename
+                self.test_suite.import_tests(sys.argv[1])
+            elif state is not None:
+                print "Resuming from checkpoint"
+                self.test_suite.set_state(state)
+        self.scheduler = ActionScheduler(self.test_suite.get_current_test().get_actions())
+        # Timings of every part of the frame loop
+        self.profiler = TickProfiler(self.PROFILE_SECTIONS,
+                                     trace_capacity=100000 if self.PROFILE_TRACE else 0)
+        # Watched RAM is fetched in one batch per frame
+        self.ram = RamSnapshot(self.read_memory)
+        # (x position, health) seen right after the quicksave loads
+        self.saved_state = None
+        self.restart_latency = LatencyHistogram()
+        # X position sampled over the run for early termination
+        self.trace = array('H')
+        # Whether the predictor ended the current run early
+        self.pruned = False
+        # Save states at position milestones, for tests sharing a prefix
+        self.checkpoints = SaveStateStore()
+        self.checkpointing = True
+        self.next_milestone = self.checkpoints.interval
         # Setup state variables
         self.jumping = False
         self.charged_shot = False
         self.playing_game = True
-        # Create keyboard
-        self.keyboard = PyKeyboard()
-        # Focus the game window
-        sneswindow = findwindow(self.BSNES_BUNDLE_ID)
-        focuswindow(sneswindow)
-        # Sleep briefly to ensure we have the window brought up
-        time.sleep(1)
-        # Start the game thread
-        self.game_thread = Thread(target=self.game_handler)
-        self.game_thread.daemon = True
-        self.game_thread.start()
-        # Start the input thread
-        self.input_queue = Queue.Queue()
-        self.input_mutex = Lock()
-        self.input_thread = Thread(target=self.input_handler)
-        self.input_thread.daemon = True
-        self.input_thread.start()
+        self.input_queue = deque()
+        # Held keys, so only real changes are sent to the game
+        self.inputs = InputController(self.backend)
+        # Bring up the game
+        self.backend.start()
+        # Have the game push watched RAM as it changes, if it can
+        if not self.ram.subscribe(self.backend.watch_memory):
+            print "RAM watch unavailable, polling instead"
         # Start AI handling
-        self.test_start_time = time.time()
-        self.update_ai()
+        self.test_start_time = self.backend.clock()
+        self.run()
+
+    def run(self):
+        """Runs the frame loop until the simulation ends or is interrupted
 
-    def update_ai(self):
-        """Handles AI logic"""
+        Every frame reads the watched RAM, runs the checks, dispatches due
+        actions and flushes input, all on this one thread. exit_handler runs
+        however the loop ends.
+        """
         print "Starting AI simulation"
         gen_num = self.test_suite.current_generation
         test_num = self.test_suite.current_test + 1
         print "Generation " + str(gen_num) + ", Test " + str(test_num)
-        self.test_start_time = time.time()
-        while self.playing_game:
-            try:
-                position = self.x_position()
-                #print "At position " + str(position)
-                if self.current_ai_actions:
-                    for index, (req_pos, action) in enumerate(self.current_ai_actions):
-                        if req_pos <= position:
-                            action_obj = MegamanAction(action)
-                            #print "Queueing action " + str(action_obj)
-                            self.queue_action(action_obj)
-                            del self.current_ai_actions[index]
-                            #print str(len(self.current_ai_actions)) + " actions left"
-                        else:
-                            break
-                time.sleep(0.2)
-            except KeyboardInterrupt:
-                self.exit_handler()
+        # Whatever was held before we started is unknown, release all of it
+        self.inputs.reset(self.KEYS)
+        self.inputs.flush()
+        self.test_start_time = self.backend.clock()
+        frame_seconds = 1.0 / self.FPS
+        next_frame = self.backend.clock()
+        try:
+            while self.playing_game:
+                self.tick()
+                # Sleep until the next frame is due, skipping any we overran
+                next_frame = next_frame + frame_seconds
+                delay = next_frame - self.backend.clock()
+                if delay > 0:
+                    self.backend.sleep(delay)
+                    self.profiler.record('overshoot', max(self.backend.clock() - next_frame, 0))
+                    self.profiler.frame()
+                else:
+                    self.profiler.frame(int(-delay / frame_seconds) + 1)
+                    next_frame = self.backend.clock()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Save results whether a winner was found, we were interrupted or
+            # something failed mid-frame
+            self.exit_handler()
+
+    def tick(self):
+        """Runs a single frame of the simulation"""
+        profiler = self.profiler
+        tick_started = started = profiler.timer()
+        # fetch every watched address for this frame
+        self.ram.refresh()
+        self.record_telemetry()
+        if self.is_showing_demo():
+            for _ in xrange(5):
+                self.queue_action(MegamanAction.START)
+        started = profiler.lap('refresh', started)
+        self.check_jumping()
+        started = profiler.lap('check_jumping', started)
+        self.check_death()
+        started = profiler.lap('check_death', started)
+        self.check_stalled()
+        started = profiler.lap('check_stalled', started)
+        self.check_min_pos()
+        started = profiler.lap('check_min_pos', started)
+        self.check_hopeless()
+        started = profiler.lap('check_hopeless', started)
+        self.check_milestone()
+        started = profiler.lap('check_milestone', started)
+        self.dispatch_actions()
+        started = profiler.lap('dispatch', started)
+        self.flush_inputs()
+        profiler.lap('flush', started)
+        profiler.lap('tick', tick_started)
+
+    def dispatch_actions(self):
+        """Queues every action whose trigger position X has passed"""
+        for action in self.scheduler.due(self.x_position()):
+            #print "Queueing action " + str(action)
+            self.queue_action(action)
 
     def queue_action(self, action):
         """Queues an action to be taken"""
-        self.input_queue.put(action)
-
-    def input_handler(self):
-        """Handles input passed to the game"""
-        self.clear_inputs()
-        msperframe = 1000 / 30 # 30 fps
-        while self.playing_game:
-            # current time
-            current = clockms()
-            # do stuff
-            if self.input_queue.qsize() > 0:
-                try:
-                    action = self.input_queue.get(True, msperframe / 1000)
-                    if action:
-                        self.perform_action(action)
-                    self.input_queue.task_done()
-                except Queue.Empty:
-                    # empty queue is OK
-                    pass
-            # get new time
-            after = clockms()
-            # if we are under the per-frame budget, wait for the rest
-            delta = after - current
-            sleeptime = msperframe - delta
-            if sleeptime > 0:
-                time.sleep(sleeptime / 1000) # convert ms back to seconds
-            if not self.playing_game:
-                break
+        self.input_queue.append(action)
+
+    def flush_inputs(self):
+        """Performs every action queued this frame and sends the key changes"""
+        fired = 0
+        while self.input_queue:
+            action = self.input_queue.popleft()
+            fired |= 1 << action.value
+            self.perform_action(action)
+        self.inputs.flush()
+        if fired and self.telemetry is not None:
+            self.telemetry.fired(fired)
+
+    def record_telemetry(self):
+        """Logs this frame's RAM values to the current run's telemetry"""
+        if self.telemetry is None:
+            return
+        self.telemetry.record(self.backend.clock() - self.test_start_time,
+                              self.x_position(), self.y_position(), 0, self.health())
 
     def clear_inputs(self):
-        """Clears out all of the current inputs that may be set"""
-        self.send_unhandled_key(self.LEFT_ARROW, False)
-        self.send_unhandled_key(self.RIGHT_ARROW, False)
-        self.send_unhandled_key(self.F4_KEY, False)
-        self.keyboard.release_key('a')
-        self.keyboard.release_key('z')
-        self.keyboard.release_key('x')
-        self.keyboard.release_key('c')
-
-    def send_unhandled_key(self, key_code, down):
-        """Sends an key to the application that is unhandled by PyKeyboard"""
-        event = Quartz.CGEventCreateKeyboardEvent(None, key_code, down)
-        Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+        """Releases every key that is held"""
+        self.inputs.release_all()
+        self.inputs.flush()
 
     def perform_action(self, action):
         """Performs an action in the game"""
-        self.input_mutex.acquire()
-        self.relevant_update_time = time.time()
-        try:
-            if action == MegamanAction.MOVE_RIGHT:
-                self.send_unhandled_key(self.LEFT_ARROW, False)
-                self.send_unhandled_key(self.RIGHT_ARROW, True)
-            elif action == MegamanAction.MOVE_LEFT:
-                self.send_unhandled_key(self.RIGHT_ARROW, False)
-                self.send_unhandled_key(self.LEFT_ARROW, True)
-            elif action == MegamanAction.STOP_MOVEMENT:
-                self.send_unhandled_key(self.LEFT_ARROW, False)
-                self.send_unhandled_key(self.RIGHT_ARROW, False)
-            elif action == MegamanAction.JUMP:
-                if not self.jumping:
-                    self.keyboard.press_key('z')
-                    self.jumping = True
-            elif action == MegamanAction.SHOOT:
-                if self.charged_shot:
-                    self.keyboard.release_key('a')
-                else:
-                    self.keyboard.tap_key('a')
-            elif action == MegamanAction.CHARGE:
-                self.keyboard.press_key('a')
-                self.charged_shot = True
-            elif action == MegamanAction.DASH:
-                self.keyboard.tap_key('x')
-            elif action == MegamanAction.CHANGE_WEAPON:
-                self.keyboard.tap_key('c')
-            elif action == MegamanAction.START:
-                self.keyboard.tap_key('return')
+        self.relevant_update_time = self.backend.clock()
+        if action == MegamanAction.MOVE_RIGHT:
+            self.inputs.release('left')
+            self.inputs.press('right')
+        elif action == MegamanAction.MOVE_LEFT:
+            self.inputs.release('right')
+            self.inputs.press('left')
+        elif action == MegamanAction.STOP_MOVEMENT:
+            self.inputs.release('left')
+            self.inputs.release('right')
+        elif action == MegamanAction.JUMP:
+            if not self.jumping:
+                self.inputs.press('z')
+                self.jumping = True
+        elif action == MegamanAction.SHOOT:
+            if self.charged_shot:
+                self.inputs.release('a')
             else:
-                print "Unknown action requested: " + str(action)
-        finally:
-            self.input_mutex.release()
+                self.inputs.tap('a')
+        elif action == MegamanAction.CHARGE:
+            self.inputs.press('a')
+            self.charged_shot = True
+        elif action == MegamanAction.DASH:
+            self.inputs.tap('x')
+        elif action == MegamanAction.CHANGE_WEAPON:
+            self.inputs.tap('c')
+        elif action == MegamanAction.START:
+            self.inputs.tap('return')
+        else:
+            print "Unknown action requested: " + str(action)
 
-    def memory(self, address, count):
-        """Gets specified amount of memory starting in an address"""
-        url = MegamanAI.REST + "?position=" + address + "&count=" + str(count)
-        data = urllib2.urlopen(url).read()[::2]
-        if count == 2:
-            return struct.unpack('H', data)[0]
-        if count == 1:
-            return struct.unpack('B', data)[0]
+    def read_memory(self, address, count):
+        """Reads the raw bytes of memory starting in an address"""
+        started = self.profiler.timer()
+        data = self.backend.read_memory(address, count)
+        self.profiler.lap('read', started)
+        return data
 
     def x_position(self):
         """Obtains the memory set for 'current X position'"""
-        return self.memory("7e0bad", 2)
+        return self.ram.get('x_position')
 
     def y_position(self):
         """Obtains the memory set for 'current Y position'"""
-        return self.memory("7e0bb0", 2)
+        return self.ram.get('y_position')
 
     def health(self):
         """Obtains the memory set for 'current health'"""
-        return self.memory("7e0bcf", 1)
+        return self.ram.get('health')
 
     def level(self):
         """Obtains the memory set for 'current level'"""
-        return self.memory("7e1f7a", 1)
+        return self.ram.get('level')
 
     def isjumping(self):
         """Identifies if we are jumping or not"""
-        jump_height = self.memory("7e0bc4", 2)
+        jump_height = self.ram.get('jump_height')
         #print "Found jump height of " + str(jump_height)
         return jump_height > 0
 
     def is_showing_demo(self):
         """Checks if we are showing a demo on the title screen"""
-        return self.memory("7e003b", 1) > 0
+        return self.ram.get('demo') > 0
 
     def exit_handler(self):
         """Handles exiting the simulation"""
         print "Exiting AI simulation"
+        print "Memory latency: " + self.backend.memory_client.latency.summary()
+        print "Restart latency: " + self.restart_latency.summary()
+        print "Tick profile: " + self.profiler.summary()
+        print "Key transitions: " + self.inputs.summary()
+        if self.PROFILE_TRACE:
+            self.profiler.dump_chrome_trace(self.PROFILE_TRACE)
         self.export_tests()
+        self.test_suite.save_cache()
+        if self.checkpointer is not None:
+            self.checkpointer.close(self.test_suite)
         self.playing_game = False
-        self.input_thread.join()
-        self.game_thread.join()
-        while not self.input_queue.empty():
-            self.input_queue.get()
-            self.input_queue.task_done()
-        self.input_queue.join()
+        # Drop anything still queued rather than sending it
+        self.input_queue.clear()
         self.clear_inputs()
+        self.ram.close()
+        if self.telemetry is not None:
+            # The unfinished run is dropped
+            self.telemetry.close()
+        self.backend.close()
 
     def export_tests(self):
-        """Exports the current generation of data to json"""
-        self.test_suite.export_tests(time.strftime("%Y-%m-%d_%H:%M:%S.json", time.gmtime()))
+        """Exports the current generation to the archive"""
+        self.test_suite.export_tests()
 
     def check_jumping(self):
         """Updates the jumping state if it was previously found to be true"""
@@ -252,34 +308,7 @@ class MegamanAI(object):
         self.jumping = self.isjumping()
         if self.jumping:
             return
-        self.keyboard.release_key('z')
-
-    def game_handler(self):
-        """Game-thread for Megaman AI"""
-        msperframe = 1000 / 30 # 30 fps
-        while self.playing_game:
-            # current time
-            current = clockms()
-            # do stuff
-            if self.is_showing_demo():
-                self.queue_action(MegamanAction.START)
-                self.queue_action(MegamanAction.START)
-                self.queue_action(MegamanAction.START)
-                self.queue_action(MegamanAction.START)
-                self.queue_action(MegamanAction.START)
-            self.check_jumping()
-            self.check_death()
-            self.check_stalled()
-            self.check_min_pos()
-            # get new time
-            after = clockms()
-            # if we are under the per-frame budget, wait for the rest
-            delta = after - current
-            sleeptime = msperframe - delta
-            if sleeptime > 0:
-                time.sleep(sleeptime / 1000) # convert ms back to seconds
-            if not self.playing_game:
-                break
+        self.inputs.release('z')
 
     def check_death(self):
         """Checks if X died. Load the save state!"""
@@ -294,14 +323,14 @@ class MegamanAI(object):
         """Checks if X is standing still for longer than 10 seconds"""
         cur_pos = self.x_position()
         if cur_pos == self.prev_position:
-            seconds_standing_still = time.time() - self.relevant_update_time
+            seconds_standing_still = self.backend.clock() - self.relevant_update_time
             if seconds_standing_still > 10:
                 #print "Score was " + str(self.ai_get_score())
                 #print "Restarting"
                 self.restart()
         else:
             self.prev_position = cur_pos
-            self.relevant_update_time = time.time()
+            self.relevant_update_time = self.backend.clock()
 
     def check_min_pos(self):
         """Ensures X has not retreated back past the minimum position"""
@@ -311,40 +340,156 @@ class MegamanAI(object):
             #print "Restarting"
             self.restart()
 
+    def check_hopeless(self):
+        """Ends the run early if it cannot make the selection cutoff"""
+        elapsed_time = self.backend.clock() - self.test_start_time
+        predictor = self.test_suite.predictor
+        # Sample X's position on the predictor's interval
+        while len(self.trace) * predictor.INTERVAL <= elapsed_time:
+            self.trace.append(self.x_position())
+        if predictor.is_hopeless(elapsed_time, self.x_position()):
+            #print "Cannot make the cutoff"
+            self.pruned = True
+            self.restart()
+
+    def check_milestone(self):
+        """Saves a checkpoint the first time X passes each position milestone"""
+        position = self.x_position()
+        if not self.checkpointing or position < self.next_milestone:
+            return
+        milestone = self.checkpoints.milestone(position)
+        self.next_milestone = milestone + self.checkpoints.interval
+        state = self.backend.save_state()
+        if state is None:
+            # The backend can't save, don't try again
+            self.checkpointing = False
+            return
+        fired_positions, fired_actions = self.scheduler.prefix(self.scheduler.position)
+        checkpoint = PrefixCheckpoint(milestone, self.scheduler.position,
+                                      fired_positions, fired_actions,
+                                      state, self.run_state())
+        self.checkpoints.add(checkpoint, *self.scheduler.prefix(milestone))
+
+    def run_state(self):
+        """Captures the per-run state a checkpoint has to carry"""
+        now = self.backend.clock()
+        return (now - self.test_start_time, now - self.relevant_update_time,
+                self.prev_position, self.current_health, self.jumping,
+                self.charged_shot, array('H', self.trace), frozenset(self.inputs.pressed),
+                self.telemetry.mark() if self.telemetry is not None else None)
+
+    def resume_from_checkpoint(self):
+        """Starts the current test from the deepest checkpoint it shares"""
+        checkpoint = self.checkpoints.find(self.scheduler)
+        if checkpoint is None:
+            return
+        # The test then just runs from the start
+        if not self.backend.restore_state(checkpoint.state):
+            return
+        self.ram.resync()
+        now = self.backend.clock()
+        (elapsed_time, still_time, self.prev_position, self.current_health,
+         self.jumping, self.charged_shot, trace, pressed, telemetry) = checkpoint.run_state
+        # The save state holds the keys that were held when it was taken
+        self.inputs.set_pressed(pressed)
+        self.test_start_time = now - elapsed_time
+        self.relevant_update_time = now - still_time
+        self.trace = array('H', trace)
+        if self.telemetry is not None:
+            self.telemetry.restore(telemetry)
+        self.scheduler.skip_to(checkpoint.fired_position)
+        self.next_milestone = checkpoint.milestone + self.checkpoints.interval
+        #print "Resuming from position " + str(checkpoint.milestone)
+
     def ai_get_score(self):
         """Obtains our AI score for how well we are doing"""
         # Distance * health ?
         return self.x_position()
 
-    def next_test(self):
+    def next_test(self, score, elapsed_time):
         """Goes to the next AI Test"""
-        score = self.ai_get_score()
-        elapsed_time = time.time() - self.test_start_time
         print ("Restarting | Score = " + str(score) +
                ", Time = " + str(round(elapsed_time, 2)) + "s" +
                ", Life = " + str(self.current_health))
-        self.test_suite.finish_current_test(score, elapsed_time, self.current_health)
-        self.current_ai_actions = list(self.test_suite.get_current_test().actions)
+        if self.telemetry is not None:
+            self.telemetry.finish_run(self.test_suite.current_generation,
+                                      self.test_suite.current_test, score, elapsed_time,
+                                      self.current_health)
+        self.test_suite.finish_current_test(score, elapsed_time, self.current_health,
+                                            self.trace, self.pruned)
+        self.trace = array('H')
+        self.pruned = False
+        self.scheduler.load(self.test_suite.get_current_test().get_actions())
         gen_num = self.test_suite.current_generation
         test_num = self.test_suite.current_test + 1
         print "Generation " + str(gen_num) + ", Test " + str(test_num)
-        self.test_start_time = time.time()
+        self.test_start_time = self.backend.clock()
 
     def restart(self):
         """Restarts the game from the quicksave"""
         # Move winner check to a better area
         winner = self.test_suite.get_winner()
         if winner is not None:
-            print "WINNER: " + winner
+            print "WINNER: " + str(winner.get_actions())
+            # Nothing left to evolve, stop the frame loop
+            self.playing_game = False
             return
 
-        self.send_unhandled_key(self.F4_KEY, True)
-        time.sleep(1)
-        self.send_unhandled_key(self.F4_KEY, False)
+        # Score the run before the reload changes what RAM shows
+        score = self.ai_get_score()
+        elapsed_time = self.backend.clock() - self.test_start_time
+        # Keys still held would move X away from the quicksave as it loads
+        self.input_queue.clear()
         self.clear_inputs()
-        self.relevant_update_time = time.time()
-        self.next_test()
+        self.reload()
+        self.relevant_update_time = self.backend.clock()
+        # Nothing should fire while the next test is fetched
+        self.scheduler.load([])
+        self.next_test(score, elapsed_time)
+        if self.checkpointing:
+            self.next_milestone = self.checkpoints.interval
+            self.resume_from_checkpoint()
+        self.ram.refresh()
+        # The new run's first row, so actions fired later this tick land in it
+        self.record_telemetry()
+
+    def reload(self):
+        """Loads the quicksave, returning once RAM shows it has loaded
+
+        Every key must be released first, so the values learned from the
+        first reload are the quicksave's own.
+        """
+        started = self.backend.clock()
+        if self.backend.load_state():
+            self.ram.resync()
+        else:
+            self.backend.press_key('f4')
+            self.wait_for_reload()
+            self.backend.release_key('f4')
+        self.ram.refresh()
+        if self.saved_state is None:
+            self.saved_state = (self.x_position(), self.health())
+        self.restart_latency.record((self.backend.clock() - started) * 1000)
+
+    def wait_for_reload(self):
+        """Polls RAM until X is back at the quicksave or the timeout passes"""
+        deadline = self.backend.clock() + self.RELOAD_TIMEOUT
+        # Until the quicksave has been seen once there is nothing to match,
+        # so wait out the full timeout
+        while self.backend.clock() < deadline:
+            self.backend.sleep(1.0 / self.FPS)
+            if self.saved_state is None:
+                continue
+            self.ram.refresh()
+            if (self.x_position(), self.health()) == self.saved_state:
+                return True
+        return False
 
 if __name__ == "__main__":
+    # Drive bsnes-plus on macOS, anywhere else run the simulated level
+    if sys.platform == "darwin":
+        from megaman_bsnes import BsnesBackend as Backend
+    else:
+        from megaman_simulator import SimulatedBackend as Backend
     # Create AI system
-    MEGAMAN_AI = MegamanAI()
+    MEGAMAN_AI = MegamanAI(Backend())
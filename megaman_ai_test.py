@@ -1,30 +1,79 @@
 """Megaman AI Testing with Genetic Algorithm"""
 
+import heapq
 import random
+from array import array
 import jsonpickle
 
 from megaman_action import MegamanAction
+from megaman_archive import GenerationArchive, is_archive
+from megaman_cache import FitnessCache
+from megaman_genetics import GeneticEngine, Population, all_pairs
+from megaman_pruning import FitnessPredictor
 
 class MegamanAITest(object):
-    """Test Instance for a run in Megaman X"""
-    def __init__(self):
-        # Randomly select a starting action between 1 & 6
-        starting_action = random.randint(MegamanAction.MOVE_RIGHT.value, MegamanAction.SHOOT.value)
+    """Test Instance for a run in Megaman X
+
+    Actions are kept in typed arrays sorted by position, one action per
+    position, so large populations and archives stay small in memory.
+    """
+    __slots__ = ('positions', 'action_values', 'fitness', 'time', 'life')
+
+    def __init__(self, actions=None):
         # Initial fitness is 0
         self.fitness = 0
         # Initial time is 0
         self.time = 0
         # Initial life is 0
         self.life = 0
-        # Start out with an initial random action
-        self.actions = [(0, starting_action)] # pos, action
+        if actions is None:
+            # Randomly select a starting action between 1 & 6
+            starting_action = random.randint(MegamanAction.MOVE_RIGHT.value,
+                                             MegamanAction.SHOOT.value)
+            # Start out with an initial random action
+            actions = [(0, starting_action)] # pos, action
+        self.actions = actions
+
+    @property
+    def actions(self):
+        """List of (pos, action) pairs sorted by position"""
+        return zip(self.positions, self.action_values)
+
+    @actions.setter
+    def actions(self, actions):
+        # Later actions at the same position replace earlier ones
+        merged = dict(actions)
+        positions = sorted(merged)
+        self.positions = array('H', positions)
+        self.action_values = array('B', [merged[pos] for pos in positions])
+
+    def set_arrays(self, positions, action_values):
+        """Replaces the actions with already sorted, deduplicated arrays"""
+        self.positions = positions
+        self.action_values = action_values
 
     def get_actions(self):
         """Obtains the set of actions"""
         return self.actions
 
+    def to_record(self):
+        """Obtains the test as a tuple of plain values, for pickling"""
+        return (self.positions.tostring(), self.action_values.tostring(),
+                self.fitness, self.time, self.life)
+
+    @classmethod
+    def from_record(cls, record):
+        """Creates a test from to_record's tuple"""
+        positions, action_values, fitness, elapsed_time, life = record
+        test = cls([])
+        test.set_arrays(array('H', positions), array('B', action_values))
+        test.fitness = fitness
+        test.time = elapsed_time
+        test.life = life
+        return test
+
 class MegamanTestsSerialized(object):
-    """Serialized set of tests"""
+    """Serialized set of tests, kept for importing older json exports"""
     def __init__(self, generation_num, tests):
         self.generation = generation_num
         self.tests = [MegamanTestSerialized(test) for test in tests]
@@ -35,12 +84,37 @@ class MegamanTestSerialized(object):
         self.actions = test.actions
 
 class MegamanAIRunner(object):
-    """Handles creating and running AI tests"""
-    def __init__(self, population, destination_position):
+    """Handles creating and running AI tests
+
+    Each new generation keeps the elitism best tests unchanged and fills the
+    rest of the population with mutated children of the top 20%, whose
+    parents are picked by tournament or in proportion to their fitness.
+    'all_pairs' instead breeds every ordered pair of the top 20%, so the
+    population grows with the square of its size.
+    """
+
+    PARENT_SELECTIONS = ('tournament', 'proportional', 'all_pairs')
+
+    def __init__(self, population, destination_position, cache=None, archive=None,
+                 checkpointer=None, elitism=2, parent_selection='tournament',
+                 tournament_size=3, prune_margin=0.25, prune_grace=2.0):
+        if parent_selection not in self.PARENT_SELECTIONS:
+            raise ValueError("Unknown parent selection " + str(parent_selection))
         self.current_generation = 1
         self.current_test = 0
+        self.population_size = population
+        self.elitism = elitism
+        self.parent_selection = parent_selection
+        self.tournament_size = tournament_size
         self.tests = self.create_tests(population)
         self.destination_position = destination_position
+        self.genetics = GeneticEngine(destination_position)
+        # Runs trailing the selection pool by more than prune_margin, after
+        # prune_grace seconds, are ended early
+        self.predictor = FitnessPredictor(prune_margin, prune_grace)
+        self.cache = cache if cache is not None else FitnessCache()
+        self.archive = archive
+        self.checkpointer = checkpointer
 
     @staticmethod
     def create_tests(population):
@@ -48,28 +122,102 @@ class MegamanAIRunner(object):
         return [MegamanAITest() for _ in xrange(population)]
 
     def get_current_test(self):
-        """Obtains the currently running test"""
+        """Obtains the currently running test, skipping any already evaluated"""
+        self.skip_cached_tests()
         return self.tests[self.current_test]
 
-    def finish_current_test(self, score, elapsed_time, life):
-        """Finishes the current test with a provided fitness score and move to the next one"""
+    def skip_cached_tests(self):
+        """Fills in cached results until the current test needs a run"""
+        while not self.have_winner():
+            result = self.cached_result(self.tests[self.current_test])
+            if result is None:
+                return
+            self.record_result(self.tests[self.current_test], *result)
+            self.next_test()
+
+    def cached_result(self, test):
+        """Obtains the cached (fitness, time, life) of a test, or None"""
+        return self.cache.get(test)
+
+    def finish_current_test(self, score, elapsed_time, life, trace=None, pruned=False):
+        """Finishes the current test with a provided fitness score and move to the next one
+
+        pruned is set when the run was ended early for trailing the selection
+        pool, so its score only holds against this session's pool.
+        """
         # Get the current test and assign the fitness score
-        test = self.get_current_test()
-        test.fitness = score
-        test.time = elapsed_time
-        test.life = life
+        test = self.tests[self.current_test]
+        self.record_result(test, score, elapsed_time, life, trace)
+        self.cache.put(test, score, elapsed_time, life, pruned)
+        self.next_test()
+
+    def next_test(self):
+        """Moves to the next test, creating a new generation after the last one"""
         # Move so that we are on the next test
         self.current_test = self.current_test + 1
         #print "Incrementing to test #" + str(self.current_test)
         # Check if we are beyond the current list of tests
-        if self.current_test >= len(self.tests):
+        new_generation = self.current_test >= len(self.tests)
+        if new_generation:
             #print "Generating a new generaetion of tests"
-            # If so, create the next generation!
-            self.generate_new_generation()
-            # Increment the generation
-            self.current_generation = self.current_generation + 1
-            # And reset the index
-            self.current_test = 0
+            self.finish_generation()
+        if self.checkpointer is not None:
+            self.checkpointer.test_finished(self, new_generation)
+
+    def get_state(self):
+        """Captures everything needed to resume the run exactly where it is"""
+        return {'generation': self.current_generation,
+                'current_test': self.current_test,
+                'tests': [test.to_record() for test in self.tests],
+                'random': random.getstate(),
+                'genetics': self.genetics.rng.get_state(),
+                'predictor': (list(self.predictor.keys),
+                              [array('H', trace) for trace in self.predictor.elite]),
+                'archive': self.archive.filename if self.archive is not None else None}
+
+    def set_state(self, state):
+        """Resumes from a state captured by get_state"""
+        self.current_generation = state['generation']
+        self.current_test = state['current_test']
+        self.tests = [MegamanAITest.from_record(record) for record in state['tests']]
+        random.setstate(state['random'])
+        self.genetics.rng.set_state(state['genetics'])
+        self.predictor.keys, self.predictor.elite = state['predictor']
+        if len(self.predictor.elite) >= self.selection_size():
+            self.predictor.set_traces(self.predictor.elite)
+
+    def save_cache(self):
+        """Writes the fitness cache to disk"""
+        self.cache.save()
+
+    def record_result(self, test, score, elapsed_time, life, trace=None):
+        """Assigns a test its results and offers its trace to the predictor"""
+        test.fitness = score
+        test.time = elapsed_time
+        test.life = life
+        if trace is not None:
+            self.predictor.record(self.selection_key(test), trace, self.selection_size())
+
+    @staticmethod
+    def selection_key(test):
+        """Obtains the key tests are ranked by, best is highest"""
+        return (test.fitness, -test.time, test.life)
+
+    def selection_size(self):
+        """Obtains how many tests survive selection - top 20%"""
+        return max(int(0.2 * self.population_size), 2)
+
+    def finish_generation(self):
+        """Moves on to the next generation once every test has a fitness score"""
+        # Keep a record of the scored population before breeding replaces it
+        if self.archive is not None:
+            self.archive.append(self.current_generation, self.tests)
+        # Create the next generation!
+        self.generate_new_generation()
+        # Increment the generation
+        self.current_generation = self.current_generation + 1
+        # And reset the index
+        self.current_test = 0
 
     def is_last_test(self):
         """Checks if this is the last test in the list"""
@@ -91,66 +239,84 @@ class MegamanAIRunner(object):
         # Check if any test hit the goal. If so, no need for a new generation!
         if self.have_winner():
             return
-        # Selection of the best fit - top 20%
-        self.tests = sorted(self.tests,
-                            key=lambda test: (test.fitness, -test.time, test.life),
-                            reverse=True)
-        self.tests = self.tests[:max(int(0.2 * len(self.tests)), 2)]
-        #print "Eliminating until we have " + str(len(self.tests)) + " tests"
+        # Selection of the best fit - top 20%, best first
+        survivors = heapq.nlargest(self.selection_size(), self.tests, key=self.selection_key)
+        #print "Eliminating until we have " + str(len(survivors)) + " tests"
+        if self.parent_selection == 'all_pairs':
+            # Survivors carry on, mutated, alongside a child of every pair
+            self.tests = survivors + self.generate_offspring(survivors)
+            self.mutate(self.tests)
+            return
+        elites = survivors[:self.elitism]
         # Crossover
-        self.generate_offspring()
-        #print "With offspring, we now have " + str(len(self.tests)) + " tests"
-        # Mutation
-        self.mutate()
+        offspring = self.generate_offspring(survivors,
+                                            max(self.population_size - len(elites), 0))
+        #print "With offspring, we now have " + str(len(offspring)) + " children"
+        # Mutation, the elites are kept exactly as they were
+        self.mutate(offspring)
+        self.tests = elites + offspring
+
+    def population(self, tests=None):
+        """Obtains the actions of tests, by default every test, as a flat Population"""
+        if tests is None:
+            tests = self.tests
+        return Population.from_arrays([(test.positions, test.action_values)
+                                       for test in tests])
+
+    def select_parents(self, parents, count):
+        """Picks count (parent_a, parent_b) index pairs from parents ranked best first"""
+        if self.parent_selection == 'all_pairs':
+            return all_pairs(len(parents))
+        if self.parent_selection == 'proportional':
+            return self.genetics.proportional_pairs([test.fitness for test in parents],
+                                                    count)
+        return self.genetics.tournament_pairs(len(parents), count, self.tournament_size)
 
-    def generate_offspring(self):
-        """Generates randomly generated children of provided test cases"""
+    def generate_offspring(self, parents, count=None):
+        """Generates children of parents ranked best first
+
+        Breeds count children, or one per ordered pair with 'all_pairs'.
+        """
         offspring = []
-        for parent_a in self.tests:
-            for parent_b in self.tests:
-                if parent_a == parent_b:
-                    continue
-                new_actions = []
-                random_action_split = random.randint(1, self.destination_position)
-                a_actions = parent_a.get_actions()
-                for pos, action in a_actions:
-                    if pos <= random_action_split:
-                        new_actions.append((pos, action))
-                b_actions = parent_b.get_actions()
-                for pos, action in b_actions:
-                    if pos > random_action_split:
-                        new_actions.append((pos, action))
-                child = MegamanAITest()
-                child.actions = new_actions
-                offspring.append(child)
-
-        self.tests.extend(offspring)
-
-    def mutate(self):
-        """Mutates the tests"""
-        for test in self.tests:
-            for pos in xrange(self.destination_position):
-                # 1% chance for mutation
-                if random.uniform(0, 1.0) <= 0.01:
-                    # Generate the new action
-                    new_action = random.randint(1, 6)
-                    # Replace the existing action, if possible
-                    for idx, (act_pos, act) in enumerate(test.actions):
-                        if act_pos == pos:
-                            if act != new_action:
-                                test.actions[idx] = (act_pos, new_action)
-                            return
-                    # Otherwise, pop in the new action
-                    test.actions.append((pos, new_action))
-
-    def export_tests(self, filename):
-        """Exports the current generation and tests to a json file"""
-        with open(filename, 'w') as writefile:
-            serialized_tests = MegamanTestsSerialized(self.current_generation, self.tests)
-            writefile.write(jsonpickle.encode(serialized_tests))
+        population = self.population(parents)
+        # Each pair is split at a random position
+        parents_a, parents_b = self.select_parents(parents, count)
+        splits = self.genetics.random_splits(len(parents_a))
+        children = self.genetics.crossover(population, parents_a, parents_b, splits)
+        for index in xrange(len(children)):
+            child = MegamanAITest([])
+            child.set_arrays(*children.genome_arrays(index))
+            offspring.append(child)
+        return offspring
+
+    def mutate(self, tests=None):
+        """Mutates tests, by default every test"""
+        if tests is None:
+            tests = self.tests
+        if not tests:
+            return
+        # 1% chance for mutation at every position of every test
+        mutated = self.genetics.mutate(self.population(tests))
+        for index, test in enumerate(tests):
+            test.set_arrays(*mutated.genome_arrays(index))
+
+    def export_tests(self, filename=None):
+        """Appends the current, possibly unfinished, generation to an archive
+
+        Defaults to the runner's own archive, and does nothing if it has none.
+        """
+        archive = self.archive
+        if filename is not None and (archive is None or archive.filename != filename):
+            archive = GenerationArchive(filename)
+        if archive is None:
+            return
+        archive.append(self.current_generation, self.tests, complete=False)
 
     def import_tests(self, filename):
-        """Imports tests from a json file"""
+        """Imports the latest generation from an archive or an older json export"""
+        if is_archive(filename):
+            self.import_archive(filename)
+            return
         with open(filename, 'r') as readfile:
             serialized_tests = jsonpickle.decode(readfile.read())
             if serialized_tests is None:
@@ -159,7 +325,21 @@ class MegamanAIRunner(object):
             self.current_generation = serialized_tests.generation
             self.tests = []
             for test in serialized_tests.tests:
-                new_test = MegamanAITest()
-                new_test.actions = test.actions
+                new_test = MegamanAITest(test.actions)
                 self.tests.append(new_test)
             self.current_test = 0
+
+    def import_archive(self, filename):
+        """Resumes from the last generation in an archive"""
+        archive = GenerationArchive(filename)
+        if not len(archive):
+            print "Unable to load tests from " + str(filename)
+            return
+        generation, complete, tests = archive.read(len(archive) - 1, MegamanAITest)
+        self.tests = tests
+        self.current_generation = generation
+        self.current_test = 0
+        if complete:
+            # Every test was scored, so carry on with the next generation
+            self.generate_new_generation()
+            self.current_generation = generation + 1
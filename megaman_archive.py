@@ -0,0 +1,210 @@
+"""Append-only binary archive of every generation's population"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+class ArchiveError(Exception):
+    """Raised when a file is not a readable generation archive"""
+    pass
+
+def is_archive(filename):
+    """Checks if a file is a generation archive"""
+    with open(filename, 'rb') as readfile:
+        return readfile.read(len(GenerationArchive.MAGIC)) == GenerationArchive.MAGIC
+
+def scan_records(data, record, magic):
+    """Obtains (offset, fields) of every whole record in a map and where they end
+
+    Records follow the file header, each starting with magic and ending its
+    header with its own size. A torn write at the end of the file is left out.
+    """
+    records = []
+    offset = GenerationArchive.HEADER.size
+    while offset + record.size <= len(data):
+        fields = record.unpack_from(data, offset)
+        size = fields[-1]
+        if fields[0] != magic or size < record.size or offset + size > len(data):
+            break
+        records.append((offset, fields))
+        offset += size
+    return records, offset
+
+def truncate_torn(filename, end):
+    """Cuts anything past the last whole record off a file
+
+    Otherwise records appended later would follow a torn one, and readers,
+    which stop at it, would never reach them.
+    """
+    if os.path.getsize(filename) > end:
+        with open(filename, 'r+b') as writefile:
+            writefile.truncate(end)
+
+class GenerationRecord(object):
+    """Location and shape of one generation within an archive"""
+    __slots__ = ('offset', 'generation', 'complete', 'count', 'total')
+
+    def __init__(self, offset, generation, complete, count, total):
+        """Constructor"""
+        self.offset = offset
+        self.generation = generation
+        self.complete = complete
+        self.count = count
+        self.total = total
+
+    def layout(self):
+        """Obtains (name, dtype, byte offset, length) of each payload array
+
+        Arrays are ordered by item size so each one stays aligned.
+        """
+        fields = (('fitness', 'd', self.count), ('time', 'd', self.count),
+                  ('offsets', 'I', self.count + 1), ('positions', 'H', self.total),
+                  ('life', 'B', self.count), ('actions', 'B', self.total))
+        offset = self.offset + GenerationArchive.RECORD.size
+        layout = []
+        for name, typecode, length in fields:
+            layout.append((name, typecode, offset, length))
+            offset += length * array(typecode).itemsize
+        return layout
+
+    def size(self):
+        """Obtains the record size in bytes, padded to 8"""
+        _, typecode, offset, length = self.layout()[-1]
+        end = offset + length * array(typecode).itemsize - self.offset
+        return (end + 7) // 8 * 8
+
+class GenerationArchive(object):
+    """Versioned archive with one record per generation
+
+    Each record holds the whole population: scores plus every genome's
+    position/action arrays. Records are found by hopping between headers, and
+    read through a memory map, so any generation can be loaded without
+    reading the rest of the file.
+
+    A generation can have several records: an incomplete one written on exit
+    and, once resumed and scored, a complete one. final_records() picks one
+    per generation.
+    """
+
+    MAGIC = 'MMXARCH\0'
+    VERSION = 1
+    HEADER = struct.Struct('<8sII')
+    RECORD_MAGIC = 'GENR'
+    RECORD = struct.Struct('<4sIIIIQ4x')
+    COMPLETE = 1
+
+    def __init__(self, filename):
+        """Constructor, creates the file if it doesn't exist"""
+        self.filename = filename
+        if not os.path.exists(filename) or not os.path.getsize(filename):
+            with open(filename, 'wb') as writefile:
+                writefile.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0))
+        self.records = []
+        self.end = self.HEADER.size
+        self.scan()
+
+    def scan(self):
+        """Indexes every record in the file, up to any torn write
+
+        The file is left as it is; a torn write is cut off by the next append.
+        """
+        self.records = []
+        with open(self.filename, 'rb') as readfile:
+            data = mmap.mmap(readfile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                magic, version, _ = self.HEADER.unpack_from(data, 0)
+                if magic != self.MAGIC:
+                    raise ArchiveError(self.filename + " is not a generation archive")
+                if version > self.VERSION:
+                    raise ArchiveError(self.filename + " has unsupported version " +
+                                       str(version))
+                records, self.end = scan_records(data, self.RECORD, self.RECORD_MAGIC)
+                for offset, (_, generation, flags, count, total, _) in records:
+                    self.records.append(GenerationRecord(offset, generation,
+                                                         bool(flags & self.COMPLETE),
+                                                         count, total))
+            finally:
+                data.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def final_records(self):
+        """Obtains one record index per generation, in generation order
+
+        That is the generation's last complete record, or its last record if
+        none is complete.
+        """
+        final = {}
+        for index, record in enumerate(self.records):
+            current = final.get(record.generation)
+            if current is None or record.complete or not self.records[current].complete:
+                final[record.generation] = index
+        return [final[generation] for generation in sorted(final)]
+
+    def append(self, generation, tests, complete=True):
+        """Appends a generation's population and its scores"""
+        lengths = [len(test.positions) for test in tests]
+        offsets = array('I', [0])
+        for length in lengths:
+            offsets.append(offsets[-1] + length)
+        record = GenerationRecord(0, generation, complete, len(tests), offsets[-1])
+        arrays = (array('d', [test.fitness for test in tests]),
+                  array('d', [test.time for test in tests]),
+                  offsets,
+                  array('H', ''.join(test.positions.tostring() for test in tests)),
+                  array('B', [test.life for test in tests]),
+                  array('B', ''.join(test.action_values.tostring() for test in tests)))
+        payload = ''.join(self.little_endian(values) for values in arrays)
+        size = record.size()
+        header = self.RECORD.pack(self.RECORD_MAGIC, generation,
+                                  self.COMPLETE if complete else 0,
+                                  len(tests), offsets[-1], size)
+        padding = '\0' * (size - len(header) - len(payload))
+        truncate_torn(self.filename, self.end)
+        with open(self.filename, 'ab') as writefile:
+            record.offset = writefile.tell()
+            writefile.write(header + payload + padding)
+        self.end = record.offset + size
+        self.records.append(record)
+
+    @staticmethod
+    def little_endian(values):
+        """Obtains an array's bytes in the archive's little-endian order"""
+        if sys.byteorder == 'big' and values.itemsize > 1:
+            values = array(values.typecode, values)
+            values.byteswap()
+        return values.tostring()
+
+    def arrays(self, index):
+        """Obtains a record's payload as NumPy arrays over a memory map"""
+        record = self.records[index]
+        with open(self.filename, 'rb') as readfile:
+            data = mmap.mmap(readfile.fileno(), 0, access=mmap.ACCESS_READ)
+        dtypes = {'d': '<f8', 'I': '<u4', 'H': '<u2', 'B': 'u1'}
+        return dict((name, np.frombuffer(data, dtype=dtypes[typecode],
+                                         count=length, offset=offset))
+                    for name, typecode, offset, length in record.layout())
+
+    def read(self, index, test_type):
+        """Obtains (generation, complete, tests) of a record as test_type instances"""
+        record = self.records[index]
+        values = self.arrays(index)
+        offsets = values['offsets'].tolist()
+        positions = values['positions'].astype(np.uint16)
+        actions = values['actions']
+        tests = []
+        for test_index in xrange(record.count):
+            start, end = offsets[test_index], offsets[test_index + 1]
+            test = test_type([])
+            test.set_arrays(array('H', positions[start:end].tostring()),
+                            array('B', actions[start:end].tostring()))
+            test.fitness = float(values['fitness'][test_index])
+            test.time = float(values['time'][test_index])
+            test.life = int(values['life'][test_index])
+            tests.append(test)
+        return record.generation, record.complete, tests
@@ -0,0 +1,86 @@
+"""Game backends that MegamanAI can drive"""
+
+import time
+
+from megaman_memory import MemoryClient, MemoryWatch
+
+class GameBackend(object):
+    """Interface to a running game: memory reads, key presses and reloads
+
+    Keys are named like PyKeyboard keys ('left', 'right', 'f4', 'a', 'z',
+    'x', 'c', 'return'). Time is read and waited on through the backend so
+    that simulated games can run faster than real time.
+    """
+    def __init__(self, rest):
+        """Constructor"""
+        self.rest = rest
+        self.memory_client = MemoryClient(rest)
+
+    def start(self):
+        """Prepares the game to receive input"""
+        pass
+
+    def read_memory(self, address, count):
+        """Reads the raw bytes of memory starting in an address"""
+        return self.memory_client.read(address, count)
+
+    def watch_memory(self, ranges):
+        """Subscribes to pushed changes of (address, count) ranges
+
+        Returns a started MemoryWatch, or None if the endpoint can't push.
+        """
+        watch = MemoryWatch(self.rest, ranges)
+        if not watch.start():
+            return None
+        return watch
+
+    def press_key(self, key):
+        """Holds down a key"""
+        raise NotImplementedError
+
+    def release_key(self, key):
+        """Releases a key"""
+        raise NotImplementedError
+
+    def tap_key(self, key):
+        """Presses and releases a key"""
+        self.press_key(key)
+        self.release_key(key)
+
+    def send_keys(self, transitions):
+        """Sends a frame's key transitions, (key, pressed) pairs, in order"""
+        for key, pressed in transitions:
+            if pressed:
+                self.press_key(key)
+            else:
+                self.release_key(key)
+
+    def load_state(self):
+        """Loads the quicksave directly, if the backend has a command for it
+
+        Returns False when it doesn't, in which case F4 has to be pressed.
+        """
+        return False
+
+    def save_state(self):
+        """Captures the game state, or returns None if the backend can't"""
+        return None
+
+    def restore_state(self, state):
+        """Restores a state from save_state
+
+        Returns False when the backend can't, like load_state.
+        """
+        return False
+
+    def clock(self):
+        """Obtains the game time in seconds"""
+        return time.time()
+
+    def sleep(self, seconds):
+        """Waits for an amount of game time"""
+        time.sleep(seconds)
+
+    def close(self):
+        """Releases any resources held by the backend"""
+        self.memory_client.close()
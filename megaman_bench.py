@@ -0,0 +1,195 @@
+"""Benchmarks of the genetic algorithm's operators and the frame loop
+
+Usage: megaman_bench.py [--population N] [--genome-length N] [--repeat N]
+                        [--ticks N] [--seed N] [--output results.json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+from megaman import MegamanAI
+from megaman_action import MegamanAction
+from megaman_ai_test import MegamanAIRunner, MegamanAITest
+from megaman_archive import GenerationArchive
+from megaman_genetics import GeneticEngine
+from megaman_simulator import SimulatedBackend
+
+try:
+    # Only available on Python 2 through the pytracemalloc backport
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class BenchmarkAI(MegamanAI):
+    """MegamanAI whose frame loop is driven tick by tick by the benchmark"""
+    def run(self):
+        """Leaves ticking to the caller"""
+        pass
+
+def synthetic_runner(population, genome_length, seed):
+    """Creates a runner with a scored population of random genomes"""
+    random.seed(seed)
+    synth = random.Random(seed)
+    runner = MegamanAIRunner(population, MegamanAI.DESTINATION_POSITION)
+    runner.tests = []
+    runner.genetics = GeneticEngine(MegamanAI.DESTINATION_POSITION,
+                                    rng=np.random.RandomState(seed))
+    positions = xrange(MegamanAI.DESTINATION_POSITION)
+    for _ in xrange(population):
+        test = MegamanAITest([])
+        test.actions = [(pos, synth.randint(MegamanAction.MOVE_RIGHT.value,
+                                            MegamanAction.CHANGE_WEAPON.value))
+                        for pos in synth.sample(positions, genome_length)]
+        test.fitness = synth.randint(MegamanAI.MIN_POSITION,
+                                     MegamanAI.DESTINATION_POSITION - 1)
+        test.time = synth.uniform(1, 60)
+        test.life = synth.randint(0, 16)
+        runner.tests.append(test)
+    return runner
+
+def measure(name, setup, operation, repeat, operations=1):
+    """Times operation(setup()) repeat times, setup isn't timed
+
+    operations is how many operations one call performs, for ops/sec.
+    """
+    timings = []
+    allocated = []
+    peaks = []
+    for _ in xrange(repeat):
+        state = setup()
+        gc.collect()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        objects = len(gc.get_objects())
+        started = timeit.default_timer()
+        operation(state)
+        timings.append(timeit.default_timer() - started)
+        allocated.append(len(gc.get_objects()) - objects)
+        if tracemalloc is not None:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    result = {'repeat': repeat,
+              'operations': operations,
+              'best_seconds': min(timings),
+              'mean_seconds': sum(timings) / len(timings),
+              'ops_per_sec': operations * len(timings) / sum(timings),
+              # Objects created by the operation and still alive after it
+              'retained_objects': max(allocated),
+              # Peak resident size of the whole process so far
+              'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    if peaks:
+        result['peak_traced_bytes'] = max(peaks)
+    print (name + ": " + str(round(result['ops_per_sec'], 2)) + " ops/sec, best " +
+           str(round(result['best_seconds'] * 1000 / operations, 3)) + "ms per op")
+    return result
+
+def bench_genetics(options):
+    """Benchmarks selection, crossover and mutation"""
+    population, genome_length, seed = options.population, options.genome_length, options.seed
+    results = {}
+
+    def survivors():
+        """Runner and its selected tests, best first"""
+        runner = synthetic_runner(population, genome_length, seed)
+        return runner, sorted(runner.tests, key=runner.selection_key,
+                              reverse=True)[:runner.selection_size()]
+
+    results['generate_new_generation'] = measure(
+        'generate_new_generation',
+        lambda: synthetic_runner(population, genome_length, seed),
+        lambda runner: runner.generate_new_generation(), options.repeat)
+    results['generate_offspring'] = measure(
+        'generate_offspring', survivors,
+        lambda (runner, parents): runner.generate_offspring(parents, population),
+        options.repeat)
+    results['mutate'] = measure(
+        'mutate', lambda: synthetic_runner(population, genome_length, seed),
+        lambda runner: runner.mutate(), options.repeat)
+    return results
+
+def bench_archive(options):
+    """Benchmarks exporting to and importing from a generation archive"""
+    directory = tempfile.mkdtemp(prefix="megaman_bench")
+    filename = os.path.join(directory, "bench.mmxa")
+    runner = synthetic_runner(options.population, options.genome_length, options.seed)
+    results = {}
+
+    def fresh_archive():
+        """Runner exporting to an empty archive"""
+        if os.path.exists(filename):
+            os.remove(filename)
+        runner.archive = GenerationArchive(filename)
+        return runner
+
+    def imported_runner():
+        """Runner about to import the archive"""
+        return MegamanAIRunner(options.population, MegamanAI.DESTINATION_POSITION)
+
+    try:
+        results['export_tests'] = measure(
+            'export_tests', fresh_archive,
+            lambda runner: runner.export_tests(), options.repeat)
+        results['import_tests'] = measure(
+            'import_tests', imported_runner,
+            lambda runner: runner.import_tests(filename), options.repeat)
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rmdir(directory)
+    return results
+
+def bench_ticks(options):
+    """Benchmarks the frame loop against the simulated REST memory server"""
+    random.seed(options.seed)
+    runner = synthetic_runner(options.population, options.genome_length, options.seed)
+    backend = SimulatedBackend()
+    ai = BenchmarkAI(backend, runner)
+
+    def ticks(_):
+        """Runs the frame loop without waiting for frame deadlines"""
+        for _ in xrange(options.ticks):
+            ai.tick()
+
+    try:
+        return {'tick': measure('tick', lambda: None, ticks, options.repeat, options.ticks)}
+    finally:
+        ai.ram.close()
+        backend.close()
+
+def main(argv):
+    """Runs every benchmark and writes the results as JSON"""
+    parser = argparse.ArgumentParser(description="Benchmarks the Megaman AI")
+    parser.add_argument('--population', type=int, default=MegamanAI.INITIAL_TESTS)
+    parser.add_argument('--genome-length', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--ticks', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=time.strftime("bench_%Y-%m-%d_%H:%M:%S.json",
+                                                          time.gmtime()))
+    options = parser.parse_args(argv)
+    results = {}
+    results.update(bench_genetics(options))
+    results.update(bench_archive(options))
+    results.update(bench_ticks(options))
+    report = {'timestamp': time.time(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'parameters': vars(options),
+              'results': results}
+    with open(options.output, 'w') as writefile:
+        json.dump(report, writefile, indent=2, sort_keys=True)
+    print "Results written to " + options.output
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+"""bsnes-plus backend driven through Apple Events and Quartz on macOS"""
+from Carbon import AppleEvents
+from Carbon import AE
+
+import time
+
+from pykeyboard import PyKeyboard
+
+from megaman_backend import GameBackend
+
+import Quartz
+
+def focuswindow(window):
+    """Focuses the provided window"""
+    if window is None:
+        pass
+    actevent = AE.AECreateAppleEvent('misc', 'actv', window,
+                                     AppleEvents.kAutoGenerateReturnID,
+                                     AppleEvents.kAnyTransactionID)
+    actevent.AESend(AppleEvents.kAEWaitReply, AppleEvents.kAENormalPriority,
+                    AppleEvents.kAEDefaultTimeout)
+
+def findwindow(bundleid):
+    """Finds a window identified by the provided bundle identifier"""
+    return AE.AECreateDesc(AppleEvents.typeApplicationBundleID, bundleid)
+
+class BsnesBackend(GameBackend):
+    """Backend for a live bsnes-plus instance"""
+
+    REST = "http://localhost:1993/"
+    BSNES_BUNDLE_ID = "org.bsnes.bsnes-plus"
+    # Keys PyKeyboard can't send are posted as raw Quartz key codes
+    UNHANDLED_KEYS = {
+        'left': 0x7B,
+        'right': 0x7C,
+        'f4': 0x76,
+    }
+
+    def __init__(self, rest=REST):
+        """Constructor"""
+        super(BsnesBackend, self).__init__(rest)
+        self.keyboard = PyKeyboard()
+
+    def start(self):
+        """Focuses the game window"""
+        sneswindow = findwindow(self.BSNES_BUNDLE_ID)
+        focuswindow(sneswindow)
+        # Sleep briefly to ensure we have the window brought up
+        time.sleep(1)
+
+    def send_unhandled_key(self, key_code, down):
+        """Sends an key to the application that is unhandled by PyKeyboard"""
+        event = Quartz.CGEventCreateKeyboardEvent(None, key_code, down)
+        Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+
+    def press_key(self, key):
+        """Holds down a key"""
+        if key in self.UNHANDLED_KEYS:
+            self.send_unhandled_key(self.UNHANDLED_KEYS[key], True)
+        else:
+            self.keyboard.press_key(key)
+
+    def release_key(self, key):
+        """Releases a key"""
+        if key in self.UNHANDLED_KEYS:
+            self.send_unhandled_key(self.UNHANDLED_KEYS[key], False)
+        else:
+            self.keyboard.release_key(key)
+
+    def tap_key(self, key):
+        """Presses and releases a key"""
+        if key in self.UNHANDLED_KEYS:
+            super(BsnesBackend, self).tap_key(key)
+        else:
+            self.keyboard.tap_key(key)
@@ -0,0 +1,76 @@
+"""Persistent cache of fitness results keyed by genome"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+def genome_key(test):
+    """Obtains a canonical hash of a test's sorted, deduplicated actions"""
+    digest = hashlib.sha1(test.positions.tostring())
+    digest.update(test.action_values.tostring())
+    return digest.hexdigest()
+
+class FitnessCache(object):
+    """LRU cache of (fitness, time, life) results, optionally saved to disk
+
+    The game replays deterministically from the quicksave, so a genome that
+    has been evaluated once doesn't need to be run again. Results of runs
+    ended early by the predictor are only kept for this session: a later one
+    may start from a weaker selection pool that would let the run finish.
+    """
+    def __init__(self, filename=None, max_entries=100000):
+        """Constructor, loads any existing cache file"""
+        self.filename = filename
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pruned = set()     # keys of results that aren't saved
+        self.hits = 0
+        self.misses = 0
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def get(self, test):
+        """Obtains the cached (fitness, time, life) of a test, or None"""
+        key = genome_key(test)
+        result = self.entries.pop(key, None)
+        if result is None:
+            self.misses = self.misses + 1
+            return None
+        # Re-insert to mark as most recently used
+        self.entries[key] = result
+        self.hits = self.hits + 1
+        return result
+
+    def put(self, test, fitness, elapsed_time, life, pruned=False):
+        """Stores the result of a test, pruned if its run was ended early"""
+        key = genome_key(test)
+        self.entries.pop(key, None)
+        self.entries[key] = (fitness, elapsed_time, life)
+        if pruned:
+            self.pruned.add(key)
+        else:
+            self.pruned.discard(key)
+        while len(self.entries) > self.max_entries:
+            self.pruned.discard(self.entries.popitem(last=False)[0])
+
+    def load(self):
+        """Loads the cache file, least recently used first"""
+        with open(self.filename, 'r') as readfile:
+            try:
+                entries = json.load(readfile)
+            except ValueError:
+                print "Unable to load fitness cache from " + str(self.filename)
+                return
+        for key, fitness, elapsed_time, life in entries[-self.max_entries:]:
+            self.entries[key] = (fitness, elapsed_time, life)
+
+    def save(self):
+        """Writes the cache file atomically"""
+        if self.filename is None:
+            return
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as writefile:
+            json.dump([[key] + list(result) for key, result in self.entries.iteritems()
+                       if key not in self.pruned], writefile)
+        os.rename(temp_filename, self.filename)
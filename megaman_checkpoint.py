@@ -0,0 +1,147 @@
+"""Periodic, crash-safe checkpoints of the genetic algorithm's state"""
+
+import cPickle
+import glob
+import os
+import Queue
+import struct
+import threading
+import zlib
+
+class RunnerCheckpointer(object):
+    """Writes MegamanAIRunner state to disk in the background
+
+    A checkpoint is taken every few finished tests and at every new
+    generation. The state is captured on the caller's thread, then pickled
+    and written by a writer thread to a temporary file that is renamed into
+    place, so a crash never leaves a half-written checkpoint behind.
+    """
+
+    MAGIC = 'MMXCKPT1'
+    HEADER = struct.Struct('<8sI')
+
+    def __init__(self, directory="checkpoints", every_tests=5, keep=3):
+        """Constructor"""
+        self.directory = directory
+        self.every_tests = every_tests
+        self.keep = keep
+        self.tests_since = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.sequence = max([self.file_sequence(filename) for filename in self.files()] or [0])
+        # Only the newest pending state matters, older ones are dropped
+        self.pending = Queue.Queue(1)
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def files(self):
+        """Obtains the checkpoint files, newest first"""
+        return sorted(glob.glob(os.path.join(self.directory, "*.ckpt")),
+                      key=self.file_sequence, reverse=True)
+
+    @staticmethod
+    def file_sequence(filename):
+        """Obtains the sequence number from a checkpoint file name"""
+        try:
+            return int(os.path.basename(filename).split('.')[0])
+        except ValueError:
+            return -1
+
+    def test_finished(self, runner, new_generation):
+        """Checkpoints the runner if enough tests have finished"""
+        self.tests_since = self.tests_since + 1
+        if new_generation or self.tests_since >= self.every_tests:
+            self.checkpoint(runner)
+
+    def checkpoint(self, runner):
+        """Queues the runner's current state to be written"""
+        self.tests_since = 0
+        state = runner.get_state()
+        while True:
+            try:
+                self.pending.put_nowait(state)
+                return
+            except Queue.Full:
+                try:
+                    self.pending.get_nowait()
+                    self.pending.task_done()
+                except Queue.Empty:
+                    pass
+
+    def write_loop(self):
+        """Writer thread, writes each queued state
+
+        A failed write is reported and the thread carries on, so the next
+        checkpoint and close() still find it running.
+        """
+        while True:
+            state = self.pending.get()
+            try:
+                if state is None:
+                    return
+                self.write(state)
+            except (IOError, OSError, cPickle.PicklingError, TypeError) as error:
+                print "Unable to write checkpoint: " + str(error)
+            finally:
+                self.pending.task_done()
+
+    def write(self, state):
+        """Writes a state atomically and prunes old checkpoints"""
+        payload = cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)
+        header = self.HEADER.pack(self.MAGIC, zlib.crc32(payload) & 0xffffffff)
+        self.sequence = self.sequence + 1
+        filename = os.path.join(self.directory, "%08d.ckpt" % self.sequence)
+        temp_filename = filename + ".tmp"
+        try:
+            with open(temp_filename, 'wb') as writefile:
+                writefile.write(header + payload)
+                writefile.flush()
+                os.fsync(writefile.fileno())
+            os.rename(temp_filename, filename)
+        except (IOError, OSError):
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        for old_filename in self.files()[self.keep:]:
+            os.remove(old_filename)
+
+    def read(self, filename):
+        """Reads a checkpoint, returning None if it is damaged"""
+        try:
+            with open(filename, 'rb') as readfile:
+                data = readfile.read()
+        except IOError:
+            return None
+        if len(data) < self.HEADER.size:
+            return None
+        magic, checksum = self.HEADER.unpack_from(data)
+        payload = data[self.HEADER.size:]
+        if magic != self.MAGIC or zlib.crc32(payload) & 0xffffffff != checksum:
+            return None
+        try:
+            return cPickle.loads(payload)
+        except (cPickle.UnpicklingError, EOFError, ValueError):
+            return None
+
+    def latest(self):
+        """Obtains the newest valid checkpointed state, or None"""
+        for filename in self.files():
+            state = self.read(filename)
+            if state is not None:
+                return state
+            print "Skipping damaged checkpoint " + filename
+        return None
+
+    def close(self, runner=None):
+        """Writes a final checkpoint, if given a runner, and stops the writer"""
+        if runner is not None:
+            self.checkpoint(runner)
+        # A writer that has died would never make room in the queue
+        while self.writer.is_alive():
+            try:
+                self.pending.put(None, True, 0.1)
+                break
+            except Queue.Full:
+                pass
+        self.writer.join()
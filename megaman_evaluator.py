@@ -0,0 +1,182 @@
+"""Evaluates a population across several game instances at once"""
+
+import argparse
+import functools
+import multiprocessing
+import Queue
+
+from megaman import MegamanAI
+from megaman_ai_test import MegamanAIRunner
+from megaman_cache import genome_key
+from megaman_pruning import FitnessPredictor
+from megaman_simulator import SimulatedBackend
+
+class WorkerTest(object):
+    """Genome handed to a worker"""
+    def __init__(self, actions):
+        self.actions = actions
+
+    def get_actions(self):
+        """Obtains the set of actions"""
+        return self.actions
+
+class WorkerTestSuite(object):
+    """Stands in for MegamanAIRunner inside a worker process
+
+    Tests come from the evaluator's task queue and results go back on its
+    result queue, so MegamanAI runs unchanged against its own backend.
+    """
+    def __init__(self, tasks, results, margin, grace):
+        """Constructor, margin and grace are the evaluator's pruning settings"""
+        self.tasks = tasks
+        self.results = results
+        self.current_generation = 0
+        self.current_test = 0
+        self.current = None
+        self.predictor = FitnessPredictor(margin, grace)
+
+    def get_current_test(self):
+        """Obtains the currently running test, waiting for one if needed"""
+        if self.current is None:
+            generation, index, actions, elite = self.tasks.get()
+            # Prune against the evaluator's selection pool as of this task
+            self.predictor.set_traces(elite)
+            self.current_generation = generation
+            self.current_test = index
+            self.current = WorkerTest(actions)
+        return self.current
+
+    def finish_current_test(self, score, elapsed_time, life, trace=None, pruned=False):
+        """Reports the result of the current test"""
+        self.results.put((self.current_generation, self.current_test,
+                          score, elapsed_time, life, trace, pruned))
+        self.current = None
+
+    def get_winner(self):
+        """Winners are decided by the evaluator"""
+        return None
+
+    def export_tests(self, filename=None):
+        """Workers hold no population to export"""
+        pass
+
+    def save_cache(self):
+        """Results are cached by the evaluator"""
+        pass
+
+def evaluation_worker(backend_factory, index, tasks, results, margin, grace):
+    """Runs a MegamanAI against its own backend until terminated"""
+    MegamanAI(backend_factory(index), WorkerTestSuite(tasks, results, margin, grace))
+
+class ParallelEvaluator(object):
+    """Hands the tests of each generation out to a pool of game instances
+
+    backend_factory(index) creates the backend for worker index, which must
+    have its own REST port and input channel.
+    """
+    def __init__(self, test_suite, backend_factory, workers):
+        """Constructor"""
+        self.test_suite = test_suite
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = []
+        # Workers prune with the runner's own settings
+        predictor = test_suite.predictor
+        for index in xrange(workers):
+            worker = multiprocessing.Process(target=evaluation_worker,
+                                             args=(backend_factory, index,
+                                                   self.tasks, self.results,
+                                                   predictor.margin, predictor.grace))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def evaluate_generation(self):
+        """Evaluates every test of the current generation and moves to the next"""
+        generation = self.test_suite.current_generation
+        tests = self.test_suite.tests
+        # Tasks are queued up front, so workers prune against the pool as it
+        # stood at the start of the generation
+        elite = self.test_suite.predictor.traces()
+        if len(elite) < self.test_suite.selection_size():
+            elite = []
+        # Tests sharing a genome are run once, by the first of them
+        sharing = {}
+        for index, test in enumerate(tests):
+            result = self.test_suite.cached_result(test)
+            if result is not None:
+                self.test_suite.record_result(test, *result)
+                continue
+            key = genome_key(test)
+            if key not in sharing:
+                sharing[key] = []
+                self.tasks.put((generation, index, list(test.get_actions()), elite))
+            sharing[key].append(index)
+        remaining = len(sharing)
+        while remaining:
+            try:
+                result = self.results.get(True, 1)
+            except Queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("All evaluation workers have exited")
+                continue
+            result_generation, index, score, elapsed_time, life, trace, pruned = result
+            if result_generation != generation:
+                continue
+            # Only one trace per genome goes to the predictor
+            self.test_suite.record_result(tests[index], score, elapsed_time, life, trace)
+            for other in sharing[genome_key(tests[index])][1:]:
+                self.test_suite.record_result(tests[other], score, elapsed_time, life)
+            self.test_suite.cache.put(tests[index], score, elapsed_time, life, pruned)
+            remaining = remaining - 1
+            print ("Generation " + str(generation) + ", Test " + str(index + 1) +
+                   " | Score = " + str(score) + ", Time = " + str(round(elapsed_time, 2)) +
+                   "s, Life = " + str(life))
+        # Only breed once every result is in
+        self.test_suite.current_test = len(tests)
+        if self.test_suite.have_winner():
+            return
+        self.test_suite.finish_generation()
+
+    def run(self):
+        """Evaluates generations until a test reaches the destination"""
+        while self.test_suite.get_winner() is None:
+            self.evaluate_generation()
+        return self.test_suite.get_winner()
+
+    def close(self):
+        """Stops every worker"""
+        # Tasks nobody will take would otherwise hold up the exit
+        self.tasks.cancel_join_thread()
+        self.results.cancel_join_thread()
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+def simulated_backend(index, base_port=1993, speed=1.0):
+    """Creates a simulated backend on its own port"""
+    return SimulatedBackend(port=base_port + index, speed=speed)
+
+if __name__ == "__main__":
+    # Usage: megaman_evaluator.py [workers] [archive.mmxa] [--speed N]
+    PARSER = argparse.ArgumentParser(description="Evaluates generations on simulated levels")
+    PARSER.add_argument('workers', nargs='?', type=int, default=multiprocessing.cpu_count())
+    PARSER.add_argument('archive', nargs='?')
+    # How many times faster than real time the simulated levels run
+    PARSER.add_argument('--speed', type=float, default=1.0)
+    OPTIONS = PARSER.parse_args()
+    TEST_SUITE = MegamanAIRunner(MegamanAI.INITIAL_TESTS, MegamanAI.DESTINATION_POSITION,
+                                 prune_margin=MegamanAI.PRUNE_MARGIN,
+                                 prune_grace=MegamanAI.PRUNE_GRACE)
+    if OPTIONS.archive is not None:
+        TEST_SUITE.import_tests(OPTIONS.archive)
+    EVALUATOR = ParallelEvaluator(TEST_SUITE,
+                                  functools.partial(simulated_backend, speed=OPTIONS.speed),
+                                  OPTIONS.workers)
+    try:
+        print "WINNER: " + str(EVALUATOR.run().get_actions())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        EVALUATOR.close()
@@ -0,0 +1,197 @@
+"""NumPy-backed genetic operators for MegamanAIRunner"""
+
+import random
+from array import array
+
+import numpy as np
+
+from megaman_action import MegamanAction
+
+def gather_ranges(starts, lengths):
+    """Obtains the indices covered by consecutive (start, length) ranges"""
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    shift = np.repeat(starts - (ends - lengths), lengths)
+    return np.arange(total, dtype=np.int64) + shift
+
+def all_pairs(count):
+    """Obtains every ordered pair (a, b) of distinct indices"""
+    parents_a, parents_b = np.nonzero(~np.eye(count, dtype=bool))
+    return parents_a, parents_b
+
+class Population(object):
+    """Actions of every genome in a population, stored flat
+
+    Genome i owns positions[offsets[i]:offsets[i + 1]] and the matching
+    actions, sorted by position with no position repeated.
+    """
+    def __init__(self, positions, actions, offsets):
+        """Constructor"""
+        self.positions = positions
+        self.actions = actions
+        self.offsets = offsets
+
+    @classmethod
+    def from_arrays(cls, genomes):
+        """Creates a population from already sorted (positions, actions) arrays
+
+        Accepts array('H')/array('B') pairs, which are read without copying.
+        """
+        lengths = np.array([len(positions) for positions, _ in genomes], dtype=np.int64)
+        offsets = np.zeros(len(genomes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = [np.frombuffer(positions, dtype=np.uint16)
+                     for positions, _ in genomes if len(positions)]
+        actions = [np.frombuffer(actions, dtype=np.uint8)
+                   for _, actions in genomes if len(actions)]
+        if not positions:
+            return cls(np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.uint8), offsets)
+        return cls(np.concatenate(positions), np.concatenate(actions), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def owners(self):
+        """Obtains the genome index of every stored action"""
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def genome(self, index):
+        """Obtains the (positions, actions) arrays of a genome"""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.positions[start:end], self.actions[start:end]
+
+    def genome_arrays(self, index):
+        """Obtains a genome as compact array('H')/array('B') storage"""
+        positions, actions = self.genome(index)
+        return (array('H', positions.astype(np.uint16).tostring()),
+                array('B', actions.astype(np.uint8).tostring()))
+
+class GeneticEngine(object):
+    """Crossover and mutation over whole populations at once"""
+    def __init__(self, destination_position, mutation_rate=0.01, rng=None):
+        """Constructor, the default rng is seeded from the random module"""
+        self.destination_position = destination_position
+        self.mutation_rate = mutation_rate
+        if rng is None:
+            rng = np.random.RandomState(random.getrandbits(32))
+        self.rng = rng
+
+    def random_splits(self, count):
+        """Draws crossover points between 1 and the destination position"""
+        return self.rng.randint(1, self.destination_position + 1, count)
+
+    def distinct_partners(self, parents_a, parents_b, count):
+        """Moves any parent_b equal to its parent_a to another parent"""
+        if count > 1:
+            same = parents_a == parents_b
+            shift = self.rng.randint(1, count, int(same.sum()))
+            parents_b[same] = (parents_a[same] + shift) % count
+        return parents_a, parents_b
+
+    def tournament_pairs(self, count, pairs, size=3):
+        """Draws pairs of parents, each the best of size random entrants
+
+        Parents must be ranked best first, so the lowest index wins.
+        """
+        entrants = self.rng.randint(0, count, (2, pairs, size))
+        parents_a, parents_b = entrants.min(axis=2)
+        return self.distinct_partners(parents_a, parents_b, count)
+
+    def proportional_pairs(self, weights, pairs):
+        """Draws pairs of parents with chances in proportion to their weights"""
+        weights = np.asarray(weights, dtype=np.float64)
+        total = weights.sum()
+        chances = weights / total if total > 0 else None
+        parents_a, parents_b = self.rng.choice(len(weights), (2, pairs), p=chances)
+        return self.distinct_partners(parents_a, parents_b, len(weights))
+
+    def crossover(self, population, parents_a, parents_b, splits):
+        """Creates one child per (parent_a, parent_b, split)
+
+        A child takes parent_a's actions up to and including split and
+        parent_b's actions after it.
+        """
+        parents_a = np.asarray(parents_a, dtype=np.int64)
+        parents_b = np.asarray(parents_b, dtype=np.int64)
+        splits = np.asarray(splits, dtype=np.int64)
+        # Positions are sorted within each genome, so offsetting them by the
+        # genome index makes the whole array searchable at once
+        span = max(int(population.positions.max()) + 1 if len(population.positions) else 1,
+                   int(splits.max()) + 1 if len(splits) else 1)
+        keys = population.owners() * span + population.positions
+        a_start = population.offsets[parents_a]
+        a_end = np.searchsorted(keys, parents_a * span + splits, side='right')
+        b_start = np.searchsorted(keys, parents_b * span + splits, side='right')
+        b_end = population.offsets[parents_b + 1]
+        starts = np.column_stack((a_start, b_start)).ravel()
+        lengths = np.column_stack((a_end - a_start, b_end - b_start)).ravel()
+        indices = gather_ranges(starts, lengths)
+        offsets = np.zeros(len(parents_a) + 1, dtype=np.int64)
+        np.cumsum(lengths.reshape(-1, 2).sum(axis=1), out=offsets[1:])
+        return Population(population.positions[indices],
+                          population.actions[indices],
+                          offsets)
+
+    def mutation_sites(self, count):
+        """Draws the sites to mutate in count genomes and a random action for each
+
+        Sites are flat indices, genome * destination_position + position.
+        The gaps between them are geometric, so each site has mutation_rate
+        chance and they come out sorted with none repeated.
+        """
+        sites_total = count * self.destination_position
+        if sites_total <= 0 or self.mutation_rate <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        expected = sites_total * self.mutation_rate
+        # Usually enough gaps to pass the last site in one draw
+        draws = int(expected + 6 * np.sqrt(expected)) + 16
+        sites = np.cumsum(self.rng.geometric(self.mutation_rate, draws)) - 1
+        while sites[-1] < sites_total:
+            more = np.cumsum(self.rng.geometric(self.mutation_rate, draws)) + sites[-1]
+            sites = np.concatenate((sites, more))
+        sites = sites[:np.searchsorted(sites, sites_total)]
+        actions = self.rng.randint(MegamanAction.MOVE_RIGHT.value,
+                                   MegamanAction.CHARGE.value + 1, len(sites))
+        return sites, actions
+
+    def apply_mutations(self, population, sites, actions):
+        """Sets actions at sorted sites from mutation_sites
+
+        The sites are merged into the already sorted population, nothing is
+        sorted again.
+        """
+        count = len(population)
+        span = self.destination_position
+        if len(population.positions):
+            span = max(span, int(population.positions.max()) + 1)
+        owners = sites // self.destination_position
+        positions = sites % self.destination_position
+        keys = population.owners() * span + population.positions
+        site_keys = owners * span + positions
+        found = np.searchsorted(keys, site_keys)
+        replaced = found < len(keys)
+        replaced[replaced] = keys[found[replaced]] == site_keys[replaced]
+        # Sites already holding an action have it replaced
+        new_actions = population.actions.copy()
+        new_actions[found[replaced]] = actions[replaced]
+        # The rest are inserted, the nth of them lands n places further on
+        inserted = ~replaced
+        slots = found[inserted] + np.arange(int(inserted.sum()))
+        is_new = np.zeros(len(keys) + len(slots), dtype=bool)
+        is_new[slots] = True
+        merged_positions = np.empty(len(is_new), dtype=np.uint16)
+        merged_positions[is_new] = positions[inserted]
+        merged_positions[~is_new] = population.positions
+        merged_actions = np.empty(len(is_new), dtype=np.uint8)
+        merged_actions[is_new] = actions[inserted]
+        merged_actions[~is_new] = new_actions
+        offsets = population.offsets.copy()
+        offsets[1:] += np.cumsum(np.bincount(owners[inserted], minlength=count))
+        return Population(merged_positions, merged_actions, offsets)
+
+    def mutate(self, population):
+        """Sets a random action at each position with mutation_rate chance"""
+        sites, actions = self.mutation_sites(len(population))
+        return self.apply_mutations(population, sites, actions)
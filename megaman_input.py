@@ -0,0 +1,72 @@
+"""Pressed-key state that only sends the key transitions actually needed"""
+
+class InputController(object):
+    """Tracks which keys are held and batches the changes of each frame
+
+    Presses of held keys and releases of keys that aren't held are dropped
+    instead of being sent. Everything else is queued until flush(), which
+    hands the frame's transitions to the sink, a GameBackend, in one batch.
+    """
+    def __init__(self, sink):
+        """Constructor"""
+        self.sink = sink
+        self.pressed = set()
+        self.pending = []   # (key, pressed) in the order they were made
+        self.sent = 0
+        self.dropped = 0
+
+    def press(self, key):
+        """Holds down a key"""
+        if key in self.pressed:
+            self.dropped = self.dropped + 1
+            return
+        self.pressed.add(key)
+        self.pending.append((key, True))
+
+    def release(self, key):
+        """Releases a key"""
+        if key not in self.pressed:
+            self.dropped = self.dropped + 1
+            return
+        self.pressed.discard(key)
+        self.pending.append((key, False))
+
+    def tap(self, key):
+        """Presses and releases a key"""
+        self.press(key)
+        self.release(key)
+
+    def is_pressed(self, key):
+        """Checks if a key is held"""
+        return key in self.pressed
+
+    def release_all(self):
+        """Releases every held key"""
+        for key in sorted(self.pressed):
+            self.release(key)
+
+    def reset(self, keys):
+        """Releases keys whether or not they are known to be held
+
+        For when the game's key state is unknown, such as at startup.
+        """
+        for key in keys:
+            self.pressed.discard(key)
+            self.pending.append((key, False))
+
+    def set_pressed(self, keys):
+        """Replaces the held keys, after restoring a save state that held them"""
+        self.pressed = set(keys)
+
+    def flush(self):
+        """Sends every transition made since the last flush"""
+        if not self.pending:
+            return
+        transitions = self.pending
+        self.pending = []
+        self.sent = self.sent + len(transitions)
+        self.sink.send_keys(transitions)
+
+    def summary(self):
+        """Obtains a printable count of sent and dropped transitions"""
+        return "sent=" + str(self.sent) + ", dropped=" + str(self.dropped)
@@ -0,0 +1,137 @@
+"""Island model: several populations evolving apart, swapping their best tests"""
+
+import multiprocessing
+import Queue
+import random
+import sys
+
+from megaman import MegamanAI
+from megaman_ai_test import MegamanAIRunner, MegamanAITest
+from megaman_evaluator import simulated_backend
+
+def ring(index, count, rng):
+    """Each island sends to the next one"""
+    return [(index + 1) % count]
+
+def fully_connected(index, count, rng):
+    """Each island sends to every other one"""
+    return [other for other in xrange(count) if other != index]
+
+def random_neighbour(index, count, rng):
+    """Each island sends to another one picked at random every migration"""
+    return [rng.choice([other for other in xrange(count) if other != index])]
+
+TOPOLOGIES = {'ring': ring, 'full': fully_connected, 'random': random_neighbour}
+
+class IslandRunner(MegamanAIRunner):
+    """MegamanAIRunner that trades its best tests with other islands
+
+    Every interval generations, once the population is scored, the best
+    migrants tests are sent to the islands the topology picks, and any tests
+    that have arrived replace the worst ones before breeding.
+    """
+    def __init__(self, population, destination_position, index, inboxes,
+                 topology=ring, interval=5, migrants=2, prune_margin=0.25, prune_grace=2.0):
+        """Constructor, inboxes holds one queue per island"""
+        super(IslandRunner, self).__init__(population, destination_position,
+                                           prune_margin=prune_margin,
+                                           prune_grace=prune_grace)
+        self.index = index
+        self.inboxes = inboxes
+        self.topology = topology
+        self.interval = interval
+        self.migrants = migrants
+        self.rng = random.Random(random.getrandbits(32))
+
+    def generate_new_generation(self):
+        """Migrates on every interval-th generation, then breeds"""
+        if (len(self.inboxes) > 1 and not self.have_winner() and
+                self.current_generation % self.interval == 0):
+            self.migrate()
+        super(IslandRunner, self).generate_new_generation()
+
+    def migrate(self):
+        """Sends the best tests out and takes in any that have arrived"""
+        self.tests.sort(key=self.selection_key, reverse=True)
+        emigrants = [test.to_record() for test in self.tests[:self.migrants]]
+        for destination in self.topology(self.index, len(self.inboxes), self.rng):
+            self.inboxes[destination].put((self.index, emigrants))
+        immigrants = []
+        while True:
+            try:
+                _, records = self.inboxes[self.index].get_nowait()
+            except Queue.Empty:
+                break
+            immigrants.extend(MegamanAITest.from_record(record) for record in records)
+        # Arrivals replace the worst tests, but never the island's own best
+        immigrants = immigrants[:len(self.tests) - self.migrants]
+        if immigrants:
+            self.tests[len(self.tests) - len(immigrants):] = immigrants
+            print ("Island " + str(self.index) + " took in " + str(len(immigrants)) +
+                   " migrants")
+
+def island_worker(backend_factory, index, inboxes, winners, population,
+                  topology, interval, migrants):
+    """Evolves one island with its own game until it finds a winner"""
+    # Forked islands would otherwise all share the parent's random state
+    random.seed()
+    runner = IslandRunner(population, MegamanAI.DESTINATION_POSITION, index, inboxes,
+                          TOPOLOGIES[topology], interval, migrants,
+                          MegamanAI.PRUNE_MARGIN, MegamanAI.PRUNE_GRACE)
+    MegamanAI(backend_factory(index), runner)
+    winner = runner.get_winner()
+    if winner is not None:
+        winners.put((index, winner.get_actions()))
+
+class IslandModel(object):
+    """Runs one island per process until any of them finds a winner
+
+    backend_factory(index) creates the backend for island index, which must
+    have its own REST port and input channel.
+    """
+    def __init__(self, backend_factory, islands, population=MegamanAI.INITIAL_TESTS,
+                 topology='ring', interval=5, migrants=2):
+        """Constructor"""
+        self.inboxes = [multiprocessing.Queue() for _ in xrange(islands)]
+        self.winners = multiprocessing.Queue()
+        self.islands = []
+        for index in xrange(islands):
+            island = multiprocessing.Process(target=island_worker,
+                                             args=(backend_factory, index, self.inboxes,
+                                                   self.winners, population, topology,
+                                                   interval, migrants))
+            island.daemon = True
+            island.start()
+            self.islands.append(island)
+
+    def run(self):
+        """Waits for a winner, returning (island index, actions)"""
+        while True:
+            try:
+                return self.winners.get(True, 1)
+            except Queue.Empty:
+                if not any(island.is_alive() for island in self.islands):
+                    raise RuntimeError("All islands have exited")
+
+    def close(self):
+        """Stops every island"""
+        for island in self.islands:
+            island.terminate()
+        for island in self.islands:
+            island.join()
+
+if __name__ == "__main__":
+    # Usage: megaman_islands.py <islands> [ring|full|random] [interval] [migrants]
+    ISLANDS = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    TOPOLOGY = sys.argv[2] if len(sys.argv) > 2 else 'ring'
+    INTERVAL = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    MIGRANTS = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+    MODEL = IslandModel(simulated_backend, ISLANDS, topology=TOPOLOGY,
+                        interval=INTERVAL, migrants=MIGRANTS)
+    try:
+        INDEX, ACTIONS = MODEL.run()
+        print "WINNER on island " + str(INDEX) + ": " + str(ACTIONS)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        MODEL.close()
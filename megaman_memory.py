@@ -0,0 +1,371 @@
+"""Batched access to the emulator's RAM"""
+
+import bisect
+import errno
+import httplib
+import Queue
+import socket
+import struct
+import threading
+import time
+import urlparse
+
+# Memory offsets obtained from:
+# http://tasvideos.org/GameResources/SNES/MegaManX/RAMMap.html
+WATCHED_ADDRESSES = (
+    ('x_position', 0x7e0bad, 'H'),
+    ('y_position', 0x7e0bb0, 'H'),
+    ('jump_height', 0x7e0bc4, 'H'),
+    ('health', 0x7e0bcf, 'B'),
+    ('level', 0x7e1f7a, 'B'),
+    ('demo', 0x7e003b, 'B'),
+)
+
+class LatencyHistogram(object):
+    """Thread-safe histogram of request latencies with log-spaced buckets"""
+
+    # Bucket upper bounds in milliseconds, the last bucket is unbounded
+    BOUNDS = (0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 125, 250, 500, 1000, 2000)
+
+    def __init__(self):
+        """Constructor"""
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.mutex = threading.Lock()
+
+    def record(self, elapsed_ms):
+        """Records a single latency sample"""
+        bucket = bisect.bisect_left(self.BOUNDS, elapsed_ms)
+        with self.mutex:
+            self.counts[bucket] += 1
+            self.total += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, percent):
+        """Obtains the upper bound of the bucket holding the given percentile"""
+        with self.mutex:
+            counts = list(self.counts)
+            total = self.total
+            max_ms = self.max_ms
+        if not total:
+            return 0.0
+        needed = total * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= needed:
+                if bucket < len(self.BOUNDS):
+                    return min(self.BOUNDS[bucket], max_ms)
+                return max_ms
+        return max_ms
+
+    def summary(self):
+        """Obtains a printable summary of the recorded latencies"""
+        if not self.total:
+            return "no requests"
+        return ("n=" + str(self.total) +
+                ", mean=" + str(round(self.total_ms / self.total, 2)) + "ms" +
+                ", p50<=" + str(round(self.percentile(50), 2)) + "ms" +
+                ", p99<=" + str(round(self.percentile(99), 2)) + "ms" +
+                ", max=" + str(round(self.max_ms, 2)) + "ms")
+
+class MemoryClient(object):
+    """Thread-safe client for the emulator memory REST endpoint
+
+    Connections are HTTP/1.1 keep-alive and pooled, so reads after the first
+    skip the TCP setup. A connection reset by the emulator, or one that has
+    waited timeout seconds for it, is discarded and the request retried on a
+    fresh one. Only a stall outlasting every retry raises.
+    """
+
+    RETRY_ERRORS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    def __init__(self, url, pool_size=4, timeout=1.0, retries=2):
+        """Constructor"""
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.timeout = timeout
+        self.retries = retries
+        self.pool = Queue.LifoQueue(pool_size)
+        self.latency = LatencyHistogram()
+
+    def connect(self):
+        """Creates a new connection to the endpoint"""
+        connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        connection.connect()
+        # Requests are tiny, don't let Nagle hold them back
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def acquire(self):
+        """Obtains an idle pooled connection, or a new one if none are idle"""
+        try:
+            return self.pool.get_nowait()
+        except Queue.Empty:
+            return self.connect()
+
+    def release(self, connection):
+        """Returns a connection to the pool, closing it if the pool is full"""
+        try:
+            self.pool.put_nowait(connection)
+        except Queue.Full:
+            connection.close()
+
+    def request(self, query):
+        """Performs a GET of the given query string and returns the body
+
+        The latency recorded spans every attempt, failed ones included.
+        """
+        attempt = 0
+        start = time.time()
+        while True:
+            connection = None
+            try:
+                connection = self.acquire()
+                connection.request("GET", self.path + "?" + query)
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error) as error:
+                if connection is not None:
+                    connection.close()
+                # A timeout has no errno, the emulator has just stalled
+                retryable = (isinstance(error, (httplib.HTTPException, socket.timeout)) or
+                             getattr(error, 'errno', None) in self.RETRY_ERRORS)
+                attempt = attempt + 1
+                if not retryable or attempt > self.retries:
+                    self.latency.record((time.time() - start) * 1000)
+                    raise
+                continue
+            self.latency.record((time.time() - start) * 1000)
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(connection)
+            return body
+
+    def read(self, address, count):
+        """Reads the raw bytes of memory starting in an address"""
+        body = self.request("position=" + address + "&count=" + str(count))
+        return body[::2]
+
+    def close(self):
+        """Closes all idle connections"""
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Queue.Empty:
+                return
+
+class MemoryWatch(object):
+    """Watched RAM ranges pushed by the emulator whenever they change
+
+    One long-lived chunked HTTP response carries a message per change: the
+    emulator frame number followed by the raw bytes of every range. A reader
+    thread keeps the latest message, so reading it costs no round trip.
+    """
+
+    HEADER = struct.Struct('<I')
+
+    def __init__(self, url, ranges, timeout=1.0):
+        """Constructor, ranges is a list of (address, count)"""
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.ranges = list(ranges)
+        self.timeout = timeout
+        self.size = self.HEADER.size + sum(count for _, count in self.ranges)
+        self.connection = None
+        self.response = None
+        self.thread = None
+        self.values = None
+        self.frame = 0
+        self.updates = 0
+
+    def start(self):
+        """Opens the stream, returning False if the endpoint can't push"""
+        query = "watch=" + ",".join(format(address, 'x') + ":" + str(count)
+                                    for address, count in self.ranges)
+        try:
+            self.connection = httplib.HTTPConnection(self.host, self.port,
+                                                     timeout=self.timeout)
+            self.connection.request("GET", self.path + "?" + query)
+            self.response = self.connection.getresponse()
+            if (self.response.status != 200 or
+                    self.response.getheader('transfer-encoding') != 'chunked'):
+                self.close()
+                return False
+            # Have values from the start, then wait on changes indefinitely
+            self.receive()
+            self.connection.sock.settimeout(None)
+        except (httplib.HTTPException, socket.error, ValueError):
+            self.close()
+            return False
+        self.thread = threading.Thread(target=self.read_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def receive(self):
+        """Reads one message from the stream"""
+        message = self.response.read(self.size)
+        if len(message) < self.size:
+            raise ValueError("RAM watch stream ended")
+        self.frame = self.HEADER.unpack_from(message)[0]
+        values = []
+        offset = self.HEADER.size
+        for _, count in self.ranges:
+            values.append(message[offset:offset + count])
+            offset += count
+        # Swap the whole tuple so readers always see one message
+        self.values = tuple(values)
+        self.updates = self.updates + 1
+
+    def read_loop(self):
+        """Reader thread, keeps the latest message until the stream ends"""
+        try:
+            while True:
+                self.receive()
+        except (httplib.HTTPException, socket.error, ValueError, AttributeError):
+            pass
+        finally:
+            self.values = None
+
+    def latest(self):
+        """Obtains the newest bytes of every range, or None once the stream is down"""
+        return self.values
+
+    def close(self):
+        """Closes the stream"""
+        self.values = None
+        connection = self.connection
+        self.connection = None
+        if connection is not None:
+            if connection.sock is not None:
+                try:
+                    # Wakes the reader thread blocked on the socket
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            connection.close()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(self.timeout)
+        self.thread = None
+
+class MemoryRange(object):
+    """Contiguous block of RAM read in one request and decoded in one unpack"""
+    def __init__(self, fields):
+        # fields is a list of (name, address, format) sorted by address
+        self.start = fields[0][1]
+        self.names = []
+        layout = '<'
+        offset = 0
+        for name, address, fmt in fields:
+            gap = (address - self.start) - offset
+            if gap > 0:
+                layout += str(gap) + 'x'
+            layout += fmt
+            offset = (address - self.start) + struct.calcsize('<' + fmt)
+            self.names.append(name)
+        self.layout = struct.Struct(layout)
+        self.count = self.layout.size
+
+    def address(self):
+        """Obtains the start address in the hex form the REST endpoint expects"""
+        return format(self.start, 'x')
+
+    def decode(self, data):
+        """Decodes the raw bytes of this range into a dict of named values"""
+        return dict(zip(self.names, self.layout.unpack_from(data)))
+
+def build_ranges(watched, max_gap=64):
+    """Groups watched addresses into as few ranges as possible
+
+    Addresses closer than max_gap bytes share a single read, since fetching a
+    few unused bytes is far cheaper than another round trip to the emulator.
+    """
+    ranges = []
+    group = []
+    for field in sorted(watched, key=lambda field: field[1]):
+        if group:
+            _, last_address, last_fmt = group[-1]
+            end = last_address + struct.calcsize('<' + last_fmt)
+            if field[1] - end > max_gap:
+                ranges.append(MemoryRange(group))
+                group = []
+        group.append(field)
+    if group:
+        ranges.append(MemoryRange(group))
+    return ranges
+
+class RamSnapshot(object):
+    """Frame-stamped cache of every RAM value the AI watches
+
+    refresh() fetches all watched addresses once per tick; the accessors then
+    decode from the cached values instead of hitting the emulator themselves.
+    """
+    def __init__(self, reader, watched=WATCHED_ADDRESSES):
+        """Constructor, reader(address, count) must return the raw bytes"""
+        self.reader = reader
+        self.ranges = build_ranges(watched)
+        self.values = {}
+        self.frame = 0
+        self.timestamp = 0
+        self.watch_memory = None
+        self.watch = None
+
+    def subscribe(self, watch_memory):
+        """Takes pushed values from watch_memory(ranges) instead of polling
+
+        watch_memory returns a started MemoryWatch, or None if the emulator
+        can't push, in which case refresh() keeps polling.
+        """
+        self.watch_memory = watch_memory
+        self.resync()
+        return self.watch is not None
+
+    def resync(self):
+        """Reopens the subscription after the game state jumps, such as a reload
+
+        Messages already in flight on the old stream may predate the jump.
+        """
+        if self.watch_memory is None:
+            return
+        if self.watch is not None:
+            self.watch.close()
+        self.watch = self.watch_memory([(memory_range.start, memory_range.count)
+                                        for memory_range in self.ranges])
+
+    def refresh(self):
+        """Takes the latest pushed values, or reads every watched range"""
+        values = {}
+        pushed = self.watch.latest() if self.watch is not None else None
+        if pushed is not None:
+            for memory_range, data in zip(self.ranges, pushed):
+                values.update(memory_range.decode(data))
+        else:
+            for memory_range in self.ranges:
+                data = self.reader(memory_range.address(), memory_range.count)
+                values.update(memory_range.decode(data))
+        # Swap the whole dict so readers on other threads see a full frame
+        self.values = values
+        self.timestamp = time.time()
+        self.frame = self.frame + 1
+
+    def get(self, name):
+        """Obtains a value from the current snapshot"""
+        if not self.frame:
+            self.refresh()
+        return self.values[name]
+
+    def close(self):
+        """Closes any subscription"""
+        self.watch_memory = None
+        if self.watch is not None:
+            self.watch.close()
+            self.watch = None
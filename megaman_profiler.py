@@ -0,0 +1,93 @@
+"""Per-tick timing of the frame loop"""
+
+import json
+import timeit
+from array import array
+
+class TickProfiler(object):
+    """Rolling timings of named sections of each frame
+
+    Every section keeps its last capacity durations in a preallocated ring
+    buffer, so recording never grows a list. Chrome trace events are kept in
+    a second set of ring buffers only when trace_capacity is non-zero.
+    """
+    def __init__(self, sections, capacity=1024, trace_capacity=0,
+                 timer=timeit.default_timer):
+        """Constructor, sections are the names that will be recorded"""
+        self.sections = tuple(sections)
+        self.index = dict((name, index) for index, name in enumerate(self.sections))
+        self.capacity = capacity
+        self.timer = timer
+        self.samples = [array('d', [0.0]) * capacity for _ in self.sections]
+        self.counts = [0] * len(self.sections)
+        self.missed_frames = 0
+        self.frames = 0
+        self.trace_capacity = trace_capacity
+        self.trace_sections = array('B', [0]) * trace_capacity
+        self.trace_starts = array('d', [0.0]) * trace_capacity
+        self.trace_durations = array('d', [0.0]) * trace_capacity
+        self.trace_count = 0
+        self.epoch = timer()
+
+    def record(self, section, duration, started=None):
+        """Records a duration in seconds for a section"""
+        index = self.index[section]
+        count = self.counts[index]
+        self.samples[index][count % self.capacity] = duration
+        self.counts[index] = count + 1
+        if self.trace_capacity and started is not None:
+            slot = self.trace_count % self.trace_capacity
+            self.trace_sections[slot] = index
+            self.trace_starts[slot] = started
+            self.trace_durations[slot] = duration
+            self.trace_count = self.trace_count + 1
+
+    def lap(self, section, started):
+        """Records the time since started for a section, returning the current time"""
+        now = self.timer()
+        self.record(section, now - started, started)
+        return now
+
+    def frame(self, missed=0):
+        """Counts a frame and any deadlines it overran"""
+        self.frames = self.frames + 1
+        self.missed_frames = self.missed_frames + missed
+
+    def window(self, section):
+        """Obtains the sorted durations currently held for a section"""
+        index = self.index[section]
+        return sorted(self.samples[index][:min(self.counts[index], self.capacity)])
+
+    def percentile(self, section, percent):
+        """Obtains a rolling percentile of a section in seconds"""
+        durations = self.window(section)
+        if not durations:
+            return 0.0
+        return durations[min(int(len(durations) * percent / 100.0), len(durations) - 1)]
+
+    def summary(self):
+        """Obtains a printable summary of every section"""
+        lines = ["frames=" + str(self.frames) + ", missed=" + str(self.missed_frames)]
+        for section in self.sections:
+            durations = self.window(section)
+            if not durations:
+                continue
+            lines.append("  " + section + ": n=" + str(self.counts[self.index[section]]) +
+                         ", p50=" + str(round(self.percentile(section, 50) * 1000, 3)) + "ms" +
+                         ", p99=" + str(round(self.percentile(section, 99) * 1000, 3)) + "ms" +
+                         ", max=" + str(round(durations[-1] * 1000, 3)) + "ms")
+        return "\n".join(lines)
+
+    def dump_chrome_trace(self, filename):
+        """Writes the held trace events in Chrome's trace event format"""
+        count = min(self.trace_count, self.trace_capacity)
+        first = self.trace_count - count
+        events = []
+        for event in xrange(first, self.trace_count):
+            slot = event % self.trace_capacity
+            events.append({'name': self.sections[self.trace_sections[slot]],
+                           'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': (self.trace_starts[slot] - self.epoch) * 1000000,
+                           'dur': self.trace_durations[slot] * 1000000})
+        with open(filename, 'w') as writefile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, writefile)
@@ -0,0 +1,57 @@
+"""Early termination of runs that cannot make the selection cutoff"""
+
+import bisect
+from array import array
+
+class FitnessPredictor(object):
+    """Compares a run's position over time against the best runs seen so far
+
+    Traces are X positions sampled every INTERVAL seconds of a run. Once
+    enough runs have finished to fill the selection pool, the envelope holds
+    the lowest position any of those runs had reached at each sample. A run
+    that falls more than margin below the envelope after the grace period is
+    behind every run currently making the cut, and is ended early.
+    """
+
+    INTERVAL = 0.5
+
+    def __init__(self, margin=0.25, grace=2.0):
+        """Constructor, margin is the fraction of the envelope a run may trail by"""
+        self.margin = margin
+        self.grace = grace
+        self.keys = []      # selection keys, ascending
+        self.elite = []     # traces matching self.keys
+        self.envelope = None
+
+    def record(self, key, trace, pool_size):
+        """Offers a finished run's trace to the selection pool"""
+        index = bisect.bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.elite.insert(index, trace)
+        # Keep only the best pool_size runs
+        del self.keys[:-pool_size]
+        del self.elite[:-pool_size]
+        if len(self.elite) >= pool_size:
+            self.set_traces(self.elite)
+
+    def traces(self):
+        """Obtains the traces of the current selection pool"""
+        return list(self.elite)
+
+    def set_traces(self, traces):
+        """Rebuilds the envelope from a full selection pool of traces"""
+        traces = [trace for trace in traces if len(trace)]
+        if not traces:
+            self.envelope = None
+            return
+        length = max(len(trace) for trace in traces)
+        # A run that ended early stays at its final position
+        self.envelope = array('H', [min(trace[min(sample, len(trace) - 1)] for trace in traces)
+                                    for sample in xrange(length)])
+
+    def is_hopeless(self, elapsed_time, position):
+        """Checks if a run is too far behind the selection pool to catch up"""
+        if self.envelope is None or elapsed_time < self.grace:
+            return False
+        sample = min(int(elapsed_time / self.INTERVAL), len(self.envelope) - 1)
+        return position < self.envelope[sample] * (1 - self.margin)
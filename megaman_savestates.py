@@ -0,0 +1,69 @@
+"""Save states taken at position milestones, for resuming shared prefixes"""
+
+import hashlib
+from array import array
+from collections import OrderedDict
+
+def prefix_key(milestone, positions, action_values):
+    """Obtains the store key of the actions up to a milestone"""
+    digest = hashlib.sha1(array('H', positions).tostring())
+    digest.update(array('B', action_values).tostring())
+    return (milestone, digest.hexdigest())
+
+class PrefixCheckpoint(object):
+    """Game and run state captured as X first passed a milestone"""
+    __slots__ = ('milestone', 'fired_position', 'fired_positions', 'fired_actions',
+                 'state', 'run_state')
+
+    def __init__(self, milestone, fired_position, fired_positions, fired_actions,
+                 state, run_state):
+        """Constructor"""
+        self.milestone = milestone
+        # Every action up to fired_position had been dispatched
+        self.fired_position = fired_position
+        self.fired_positions = fired_positions
+        self.fired_actions = fired_actions
+        # Backend save state and MegamanAI's own per-run state
+        self.state = state
+        self.run_state = run_state
+
+class SaveStateStore(object):
+    """Bounded LRU store of checkpoints keyed by milestone and action prefix
+
+    Play is deterministic from the quicksave, so a test whose actions match a
+    checkpoint's dispatched actions exactly can resume from it.
+    """
+    def __init__(self, interval=250, max_states=128):
+        """Constructor"""
+        self.interval = interval
+        self.max_states = max_states
+        self.checkpoints = OrderedDict()
+
+    def milestone(self, position):
+        """Obtains the deepest milestone at or below a position"""
+        return position // self.interval * self.interval
+
+    def add(self, checkpoint, prefix_positions, prefix_actions):
+        """Stores a checkpoint under the actions up to its milestone"""
+        key = prefix_key(checkpoint.milestone, prefix_positions, prefix_actions)
+        self.checkpoints.pop(key, None)
+        self.checkpoints[key] = checkpoint
+        while len(self.checkpoints) > self.max_states:
+            self.checkpoints.popitem(last=False)
+
+    def find(self, scheduler):
+        """Obtains the deepest checkpoint the scheduler's actions can resume from"""
+        milestones = sorted(set(milestone for milestone, _ in self.checkpoints), reverse=True)
+        for milestone in milestones:
+            key = prefix_key(milestone, *scheduler.prefix(milestone))
+            checkpoint = self.checkpoints.get(key)
+            if checkpoint is None:
+                continue
+            positions, actions = scheduler.prefix(checkpoint.fired_position)
+            if (positions == checkpoint.fired_positions and
+                    actions == checkpoint.fired_actions):
+                # Mark as most recently used
+                del self.checkpoints[key]
+                self.checkpoints[key] = checkpoint
+                return checkpoint
+        return None
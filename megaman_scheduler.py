@@ -0,0 +1,48 @@
+"""Dispatches a test's actions as X reaches their trigger positions"""
+
+import bisect
+
+from megaman_action import MegamanAction
+
+class ActionScheduler(object):
+    """Cursor over a run's actions, sorted once when the run is loaded"""
+    def __init__(self, actions=()):
+        """Constructor"""
+        self.positions = []
+        self.actions = []
+        self.cursor = 0
+        self.position = -1
+        self.load(actions)
+
+    def load(self, actions):
+        """Loads the (pos, action) pairs of a new run"""
+        # Stable sort so actions sharing a position keep their order
+        ordered = sorted(actions, key=lambda pair: pair[0])
+        self.positions = [pos for pos, _ in ordered]
+        self.actions = [MegamanAction(action) for _, action in ordered]
+        self.cursor = 0
+        # Furthest position actions have been dispatched up to
+        self.position = -1
+
+    def due(self, position):
+        """Obtains every action whose trigger position has been passed"""
+        end = bisect.bisect_right(self.positions, position, self.cursor)
+        actions = self.actions[self.cursor:end]
+        self.cursor = end
+        self.position = max(self.position, position)
+        return actions
+
+    def skip_to(self, position):
+        """Treats every action up to a position as already dispatched"""
+        self.cursor = bisect.bisect_right(self.positions, position)
+        self.position = position
+
+    def prefix(self, position):
+        """Obtains the positions and action values up to a position"""
+        end = bisect.bisect_right(self.positions, position)
+        return (self.positions[:end],
+                [action.value for action in self.actions[:end]])
+
+    def remaining(self):
+        """Obtains how many actions are left to dispatch"""
+        return len(self.actions) - self.cursor
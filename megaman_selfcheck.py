@@ -0,0 +1,291 @@
+"""Self-checks of the binary formats, genetic operators and frame loop
+
+Usage: megaman_selfcheck.py
+Runs every check against seeded data and the simulated level, stopping at
+the first one that fails.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+from array import array
+
+import numpy as np
+
+from megaman import MegamanAI
+from megaman_ai_test import MegamanAIRunner, MegamanAITest
+from megaman_archive import GenerationArchive
+from megaman_cache import FitnessCache
+from megaman_checkpoint import RunnerCheckpointer
+from megaman_genetics import GeneticEngine, Population
+from megaman_simulator import SimulatedBackend
+from megaman_telemetry import TelemetryLog, TelemetryReader
+
+def expect(condition, message):
+    """Fails the current check unless condition holds"""
+    if not condition:
+        raise AssertionError(message)
+
+class SteppedAI(MegamanAI):
+    """MegamanAI whose frame loop is stepped by the check"""
+    def run(self):
+        """Leaves ticking to the caller"""
+        pass
+
+def check_telemetry_actions(directory):
+    """Every logged run records the actions it fired, including its first tick's"""
+    filename = os.path.join(directory, "check.mmxt")
+    backend = SimulatedBackend(speed=20.0)
+    runner = MegamanAIRunner(MegamanAI.INITIAL_TESTS, MegamanAI.DESTINATION_POSITION)
+    ai = SteppedAI(backend, runner, TelemetryLog(filename))
+    try:
+        # Every restart finishes a run
+        while ai.restart_latency.total < 4:
+            ai.tick()
+            backend.sleep(1.0 / ai.FPS)
+    finally:
+        ai.ram.close()
+        ai.telemetry.close()
+        backend.close()
+    reader = TelemetryReader(filename)
+    try:
+        expect(len(reader) >= 4, "expected at least 4 logged runs")
+        for run in xrange(len(reader)):
+            actions = reader.column(run, 'actions')
+            # Every genome fires an action at position 0, on the run's first tick
+            expect(actions.any(), "run " + str(run) + " logged no fired actions")
+            expect(actions[0], "run " + str(run) + " lost its first tick's actions")
+        furthest = [reader.column(run, 'x').max() if reader.rows[run] else 0
+                    for run in xrange(len(reader))]
+        expect(reader.furthest().tolist() == furthest, "furthest X differs from the columns")
+    finally:
+        reader.close()
+
+def log_runs(filename, synth, first_test, count, rows):
+    """Logs count runs of random rows, obtaining each run's (test, X column)"""
+    log = TelemetryLog(filename)
+    runs = []
+    for test in xrange(first_test, first_test + count):
+        xs = [synth.randint(0, 7600) for _ in xrange(rows)]
+        for x_position in xs:
+            log.record(synth.random(), x_position, 0, 0, 16)
+        log.finish_run(1, test, max(xs or [0]), 0.0, 16)
+        runs.append((test, xs))
+    log.close()
+    return runs
+
+def check_telemetry_torn_run(directory):
+    """Runs logged after a crash follow the last whole run, not the torn one"""
+    filename = os.path.join(directory, "torn.mmxt")
+    synth = random.Random(0)
+    runs = log_runs(filename, synth, 0, 3, 20)
+    # A run cut short by a crash, claiming more bytes than were written
+    with open(filename, 'ab') as writefile:
+        writefile.write(TelemetryLog.RECORD.pack(TelemetryLog.RECORD_MAGIC, 1, 3, 16, 400,
+                                                 0.0, 0.0, 4096))
+        writefile.write('\0' * 64)
+    runs.extend(log_runs(filename, synth, 3, 3, 400))
+    reader = TelemetryReader(filename)
+    try:
+        expect(len(reader) == len(runs),
+               "expected " + str(len(runs)) + " runs, found " + str(len(reader)))
+        for run, (test, xs) in enumerate(runs):
+            expect(reader.test[run] == test and reader.column(run, 'x').tolist() == xs,
+                   "run " + str(run) + " differs")
+    finally:
+        reader.close()
+
+class StateRunner(object):
+    """Stands in for a MegamanAIRunner, handing out the given states in turn"""
+    def __init__(self, states):
+        """Constructor"""
+        self.states = list(states)
+
+    def get_state(self):
+        """Obtains the next state"""
+        return self.states.pop(0)
+
+def expect_returns(function, seconds, message):
+    """Fails the current check if function hasn't returned within seconds"""
+    thread = threading.Thread(target=function)
+    thread.daemon = True
+    thread.start()
+    thread.join(seconds)
+    expect(not thread.is_alive(), message)
+
+def check_checkpoint_write_error(directory):
+    """A failed checkpoint write neither stops later ones nor hangs close()"""
+    checkpointer = RunnerCheckpointer(os.path.join(directory, "checkpoints"))
+    # Functions can't be pickled
+    runner = StateRunner([{'unpicklable': lambda: None}, {'generation': 2}])
+    checkpointer.checkpoint(runner)
+    expect_returns(lambda: checkpointer.close(runner), 5, "close() hung after a failed write")
+    expect(checkpointer.latest() == {'generation': 2}, "the write after the failure was lost")
+    # A writer that died anyway mustn't hang close() either
+    checkpointer = RunnerCheckpointer(os.path.join(directory, "checkpoints"))
+    checkpointer.pending.put(None)
+    checkpointer.writer.join()
+    runner = StateRunner([{'generation': 3}, {'generation': 4}])
+    checkpointer.checkpoint(runner)
+    expect_returns(lambda: checkpointer.close(runner), 5, "close() hung on a dead writer")
+
+def check_cache_skips_pruned(directory):
+    """Results of runs ended early stay out of the saved fitness cache"""
+    filename = os.path.join(directory, "cache.json")
+    full, pruned, finished = [MegamanAITest([(pos, 1)]) for pos in (10, 20, 30)]
+    cache = FitnessCache(filename, max_entries=3)
+    cache.put(full, 900, 5.0, 16)
+    cache.put(pruned, 300, 2.5, 16, pruned=True)
+    # A full run of a genome that was once pruned replaces its result
+    cache.put(finished, 400, 3.0, 16, pruned=True)
+    cache.put(finished, 700, 8.0, 12)
+    expect(cache.get(pruned) == (300, 2.5, 16), "pruned result not kept for the session")
+    cache.save()
+    saved = FitnessCache(filename)
+    expect(saved.get(full) == (900, 5.0, 16), "full result not saved")
+    expect(saved.get(finished) == (700, 8.0, 12), "finished result not saved")
+    expect(saved.get(pruned) is None, "pruned result saved")
+    # Evicting a pruned result forgets it was pruned
+    for pos in (40, 50, 60):
+        cache.put(MegamanAITest([(pos, 1)]), 100, 1.0, 16)
+    expect(len(cache.pruned) == 0, "evicted result still marked as pruned")
+
+def random_genomes(synth, count, destination_position):
+    """Obtains count genomes as sorted lists of (pos, action) pairs"""
+    genomes = []
+    for _ in xrange(count):
+        # Some positions lie beyond the destination, as imported tests can
+        positions = sorted(synth.sample(xrange(destination_position + 10),
+                                        synth.randint(0, destination_position)))
+        genomes.append([(pos, synth.randint(1, 6)) for pos in positions])
+    return genomes
+
+def to_population(genomes):
+    """Packs lists of (pos, action) pairs into a Population"""
+    return Population.from_arrays([(array('H', [pos for pos, _ in genome]),
+                                    array('B', [action for _, action in genome]))
+                                   for genome in genomes])
+
+def genome_list(population, index):
+    """Obtains a genome of a Population as a list of (pos, action) pairs"""
+    positions, actions = population.genome(index)
+    return zip(positions.tolist(), actions.tolist())
+
+def check_crossover(directory):
+    """Crossover matches a plain Python splice of both parents"""
+    for seed in xrange(50):
+        synth = random.Random(seed)
+        destination_position = synth.randint(1, 80)
+        genomes = random_genomes(synth, synth.randint(1, 8), destination_position)
+        engine = GeneticEngine(destination_position, rng=np.random.RandomState(seed))
+        parents_a, parents_b = engine.tournament_pairs(len(genomes), 20)
+        splits = engine.random_splits(20)
+        children = engine.crossover(to_population(genomes), parents_a, parents_b, splits)
+        expect(len(children) == 20, "seed " + str(seed) + " bred the wrong number of children")
+        for index, (parent_a, parent_b, split) in enumerate(zip(parents_a, parents_b, splits)):
+            expected = ([pair for pair in genomes[parent_a] if pair[0] <= split] +
+                        [pair for pair in genomes[parent_b] if pair[0] > split])
+            expect(genome_list(children, index) == expected,
+                   "seed " + str(seed) + " child " + str(index) + " differs")
+
+def check_mutate(directory):
+    """Mutation matches setting each drawn site's action in plain Python"""
+    for seed in xrange(50):
+        synth = random.Random(seed)
+        destination_position = synth.randint(1, 80)
+        genomes = random_genomes(synth, synth.randint(1, 8), destination_position)
+        engine = GeneticEngine(destination_position, mutation_rate=synth.uniform(0, 0.5),
+                               rng=np.random.RandomState(seed))
+        sites, actions = engine.mutation_sites(len(genomes))
+        expect(list(sites) == sorted(set(sites)), "seed " + str(seed) + " repeated a site")
+        mutated = engine.apply_mutations(to_population(genomes), sites, actions)
+        expected = [dict(genome) for genome in genomes]
+        for site, action in zip(sites.tolist(), actions.tolist()):
+            expected[site // destination_position][site % destination_position] = action
+        for index in xrange(len(genomes)):
+            expect(genome_list(mutated, index) == sorted(expected[index].items()),
+                   "seed " + str(seed) + " genome " + str(index) + " differs")
+
+def test_summary(test):
+    """Obtains everything an archive stores about a test"""
+    return (test.positions.tolist(), test.action_values.tolist(),
+            test.fitness, test.time, test.life)
+
+def append_generation(archive, synth, generation, complete, count, destination_position):
+    """Appends a generation of random scored tests, obtaining what was stored"""
+    tests = []
+    for genome in random_genomes(synth, count, destination_position):
+        test = MegamanAITest(genome)
+        test.fitness = synth.uniform(0, 7600)
+        test.time = synth.uniform(0, 60)
+        test.life = synth.randint(0, 16)
+        tests.append(test)
+    archive.append(generation, tests, complete)
+    return generation, complete, [test_summary(test) for test in tests]
+
+def expect_generations(archive, generations):
+    """Every record of an archive reads back as it was appended"""
+    expect(len(archive) == len(generations),
+           "expected " + str(len(generations)) + " records, found " + str(len(archive)))
+    for index, (generation, complete, summaries) in enumerate(generations):
+        read_generation, read_complete, tests = archive.read(index, MegamanAITest)
+        expect((read_generation, read_complete) == (generation, complete),
+               "record " + str(index) + " has the wrong generation")
+        expect([test_summary(test) for test in tests] == summaries,
+               "record " + str(index) + " tests differ")
+        values = archive.arrays(index)
+        expect(values['offsets'][-1] == len(values['positions']) == len(values['actions']),
+               "record " + str(index) + " offsets don't cover its actions")
+        expect(values['fitness'].tolist() == [summary[2] for summary in summaries],
+               "record " + str(index) + " fitness differs")
+
+def check_archive_round_trip(directory):
+    """Archived generations read back unchanged, before and after a torn write"""
+    filename = os.path.join(directory, "check.mmxa")
+    synth = random.Random(0)
+    archive = GenerationArchive(filename)
+    # (generation, complete) of each record, as exits and resumes write them
+    generations = [append_generation(archive, synth, generation, complete,
+                                     synth.randint(0, 6), 100)
+                   for generation, complete in ((1, False), (1, True), (2, False),
+                                                (3, True), (3, False), (4, False))]
+    # A record cut short by a crash, claiming more bytes than were written
+    with open(filename, 'ab') as writefile:
+        writefile.write(GenerationArchive.RECORD.pack(GenerationArchive.RECORD_MAGIC, 5,
+                                                      GenerationArchive.COMPLETE, 4, 40, 4096))
+        writefile.write('\0' * 64)
+    archive = GenerationArchive(filename)
+    expect_generations(archive, generations)
+    # The complete record wins over a later incomplete one, else the last one
+    expect(archive.final_records() == [1, 2, 3, 5], "wrong final records " +
+           str(archive.final_records()))
+    # Resuming after the crash appends past the torn record's claimed size,
+    # which must not turn it into a record
+    generations.append(append_generation(archive, synth, 4, True, 40, 400))
+    generations.append(append_generation(archive, synth, 5, False, 40, 400))
+    expect(os.path.getsize(filename) > archive.records[5].offset + 4096,
+           "appended too little to cover the torn record")
+    expect_generations(GenerationArchive(filename), generations)
+
+CHECKS = (check_archive_round_trip,
+          check_telemetry_torn_run,
+          check_checkpoint_write_error,
+          check_cache_skips_pruned,
+          check_crossover,
+          check_mutate,
+          check_telemetry_actions)
+
+def main():
+    """Runs every check in a scratch directory"""
+    directory = tempfile.mkdtemp(prefix="megaman_check")
+    try:
+        for check in CHECKS:
+            check(directory)
+            print "ok " + check.__name__
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
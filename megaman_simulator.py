@@ -0,0 +1,369 @@
+"""Headless stand-in for bsnes-plus running a deterministic simulated level"""
+
+import BaseHTTPServer
+import random
+import select
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+import urlparse
+
+from megaman_backend import GameBackend
+
+class SimulatedLevel(object):
+    """Deterministic side-scrolling level with walls, pits and enemies
+
+    The player state is mirrored into a RAM image at the same addresses the
+    real game uses, so MegamanAI reads it exactly as it would from bsnes.
+    """
+
+    FPS = 60
+    RAM_BANK = 0x7e0000
+    RAM_SIZE = 0x10000
+    START_POSITION = 200
+    GROUND_Y = 0x180
+    MAX_HEALTH = 16
+    WALK_SPEED = 1.5
+    DASH_SPEED = 3.5
+    DASH_FRAMES = 16
+    JUMP_VELOCITY = 5.0
+    GRAVITY = 0.25
+    WALL_WIDTH = 16
+    SHOT_RANGE = 160
+    ENEMY_REACH = 24
+    ENEMY_DAMAGE = 2
+    ENEMY_COOLDOWN = 30
+    LEVEL_ID = 1
+
+    def __init__(self, length=8000, seed=0):
+        """Constructor"""
+        self.length = length
+        self.walls = []    # (position, height)
+        self.pits = []     # (start, end)
+        self.enemies = []  # position
+        rng = random.Random(seed)
+        position = self.START_POSITION + 200
+        while position < length - 200:
+            kind = rng.randint(0, 2)
+            if kind == 0:
+                self.walls.append((position, rng.randint(16, 40)))
+            elif kind == 1:
+                width = rng.randint(32, 56)
+                self.pits.append((position, position + width))
+            else:
+                self.enemies.append(position)
+            position += rng.randint(250, 550)
+        self.ram = bytearray(self.RAM_SIZE)
+        self.frame = 0
+        self.keys = set()
+        self.reset()
+
+    def reset(self):
+        """Returns the player to the start of the level, like loading the quicksave"""
+        self.x_position = float(self.START_POSITION)
+        self.height = 0.0
+        self.velocity = 0.0
+        self.health = self.MAX_HEALTH
+        self.dash_frames = 0
+        self.hurt_frames = 0
+        self.alive_enemies = set(self.enemies)
+        self.keys = set()
+        self.write_ram()
+
+    def get_state(self):
+        """Obtains a copy of the player state"""
+        return (self.x_position, self.height, self.velocity, self.health,
+                self.dash_frames, self.hurt_frames, frozenset(self.alive_enemies),
+                frozenset(self.keys))
+
+    def set_state(self, state):
+        """Restores the player state from get_state"""
+        (self.x_position, self.height, self.velocity, self.health,
+         self.dash_frames, self.hurt_frames, alive_enemies, keys) = state
+        self.alive_enemies = set(alive_enemies)
+        self.keys = set(keys)
+        self.write_ram()
+
+    def press_key(self, key):
+        """Holds down a key"""
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        if key == 'z' and self.height <= 0:
+            self.velocity = self.JUMP_VELOCITY
+        elif key == 'x':
+            self.dash_frames = self.DASH_FRAMES
+        elif key == 'a':
+            self.fire()
+        elif key == 'f4':
+            self.reset()
+
+    def release_key(self, key):
+        """Releases a key"""
+        self.keys.discard(key)
+
+    def fire(self):
+        """Destroys the nearest living enemy within range ahead of the player"""
+        ahead = [enemy for enemy in self.alive_enemies
+                 if 0 <= enemy - self.x_position <= self.SHOT_RANGE]
+        if ahead:
+            self.alive_enemies.discard(min(ahead))
+
+    def in_pit(self, position):
+        """Checks if a position is over a pit"""
+        for start, end in self.pits:
+            if start <= position < end:
+                return True
+        return False
+
+    def blocking_wall(self, start, end):
+        """Obtains the first wall between two positions taller than the player's height"""
+        low, high = min(start, end), max(start, end)
+        for position, height in self.walls:
+            if (low < position + self.WALL_WIDTH and position <= high and
+                    self.height <= height):
+                return position
+        return None
+
+    def step(self):
+        """Advances the level by a single frame"""
+        self.frame = self.frame + 1
+        if self.health <= 0:
+            return
+        speed = self.DASH_SPEED if self.dash_frames > 0 else self.WALK_SPEED
+        self.dash_frames = max(self.dash_frames - 1, 0)
+        direction = 0
+        if 'right' in self.keys:
+            direction = 1
+        elif 'left' in self.keys:
+            direction = -1
+        target = min(max(self.x_position + direction * speed, 0), self.length)
+        wall = self.blocking_wall(self.x_position, target) if direction else None
+        if wall is None:
+            self.x_position = target
+        elif direction > 0:
+            self.x_position = min(self.x_position, wall - 1)
+        else:
+            self.x_position = max(self.x_position, wall + self.WALL_WIDTH)
+        # Vertical movement, landing in a pit is fatal
+        if self.height > 0 or self.velocity > 0:
+            self.height = max(self.height + self.velocity, 0)
+            self.velocity = self.velocity - self.GRAVITY
+            if self.height <= 0:
+                self.velocity = 0.0
+        if self.height <= 0 and self.in_pit(self.x_position):
+            self.health = 0
+        # Living enemies hurt the player when close
+        self.hurt_frames = max(self.hurt_frames - 1, 0)
+        if not self.hurt_frames:
+            for enemy in self.alive_enemies:
+                if abs(enemy - self.x_position) <= self.ENEMY_REACH:
+                    self.health = max(self.health - self.ENEMY_DAMAGE, 0)
+                    self.hurt_frames = self.ENEMY_COOLDOWN
+                    break
+        self.write_ram()
+
+    def write_ram(self):
+        """Mirrors the player state into the RAM image"""
+        struct.pack_into('<H', self.ram, 0x0bad, int(self.x_position))
+        struct.pack_into('<H', self.ram, 0x0bb0, int(self.GROUND_Y - self.height))
+        struct.pack_into('<H', self.ram, 0x0bc4, int(self.height))
+        self.ram[0x0bcf] = self.health
+        self.ram[0x1f7a] = self.LEVEL_ID
+        self.ram[0x003b] = 0
+
+    def read(self, address, count):
+        """Reads count bytes of RAM starting at an absolute address"""
+        offset = address - self.RAM_BANK
+        return str(self.ram[offset:offset + count])
+
+class SimulatedRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves RAM using the same ?position=&count= protocol as bsnes-plus
+
+    ?watch=address:count,... instead streams the ranges as they change.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Buffer the response so headers and body go out in one segment
+    wbufsize = -1
+
+    def do_GET(self):
+        """Handles a memory read"""
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        if 'watch' in query:
+            self.stream_watch(query['watch'][0])
+            return
+        try:
+            address = int(query['position'][0], 16)
+            count = int(query['count'][0])
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+        data = self.server.backend.read_ram(address, count)
+        # The endpoint sends two bytes per byte of RAM
+        body = ''.join(byte + '\x00' for byte in data)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def stream_watch(self, watch):
+        """Pushes the watched ranges every level frame in which they change"""
+        try:
+            ranges = [(int(address, 16), int(count))
+                      for address, count in (item.split(':') for item in watch.split(','))]
+        except ValueError:
+            self.send_error(400)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        backend = self.server.backend
+        header = struct.Struct('<I')
+        last = None
+        while not backend.closed.is_set():
+            frame, data = backend.read_ranges(ranges)
+            if data != last:
+                message = header.pack(frame) + data
+                self.wfile.write(format(len(message), 'x') + "\r\n" + message + "\r\n")
+                self.wfile.flush()
+                last = data
+            # Wait a level frame, unless the client hangs up first
+            readable, _, _ = select.select([self.connection], [], [], backend.frame_seconds())
+            if readable and not self.connection.recv(1):
+                self.close_connection = 1
+                return
+        # The backend closed, end the stream cleanly
+        self.wfile.write("0\r\n\r\n")
+        self.wfile.flush()
+        self.close_connection = 1
+
+    def log_message(self, *args):
+        """Silences per-request logging"""
+        pass
+
+class SimulatedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded REST server for a simulated level"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, backend, port):
+        """Constructor"""
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           SimulatedRequestHandler)
+        self.backend = backend
+
+    def handle_error(self, request, client_address):
+        """Ignores clients dropping their keep-alive connections"""
+        if isinstance(sys.exc_info()[1], socket.error):
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+class SimulatedBackend(GameBackend):
+    """Backend running a simulated level behind a local REST server
+
+    The level advances with the backend clock, which runs speed times faster
+    than real time, so timeouts such as the stall check scale with it.
+    """
+    def __init__(self, port=0, speed=1.0, level=None):
+        """Constructor, a port of 0 picks a free one"""
+        self.level = level if level is not None else SimulatedLevel()
+        self.speed = speed
+        # Re-entrant so an interrupt landing mid-acquire on the main thread
+        # can't leave it locked against the shutdown path
+        self.mutex = threading.RLock()
+        # Set on close, ending every watch stream within a level frame
+        self.closed = threading.Event()
+        self.started = time.time()
+        self.server = SimulatedServer(self, port)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        port = self.server.server_address[1]
+        super(SimulatedBackend, self).__init__("http://localhost:" + str(port) + "/")
+
+    def sync(self):
+        """Advances the level up to the current clock"""
+        target = int(self.clock() * self.level.FPS)
+        while self.level.frame < target:
+            self.level.step()
+
+    def read_ram(self, address, count):
+        """Reads RAM directly from the level"""
+        with self.mutex:
+            self.sync()
+            return self.level.read(address, count)
+
+    def press_key(self, key):
+        """Holds down a key"""
+        with self.mutex:
+            self.sync()
+            self.level.press_key(key)
+
+    def release_key(self, key):
+        """Releases a key"""
+        with self.mutex:
+            self.sync()
+            self.level.release_key(key)
+
+    def read_ranges(self, ranges):
+        """Reads several (address, count) ranges within one level frame"""
+        with self.mutex:
+            self.sync()
+            return self.level.frame, ''.join(self.level.read(address, count)
+                                             for address, count in ranges)
+
+    def frame_seconds(self):
+        """Obtains the real time a level frame lasts"""
+        return 1.0 / self.level.FPS / self.speed
+
+    def send_keys(self, transitions):
+        """Applies a frame's key transitions together"""
+        with self.mutex:
+            self.sync()
+            for key, pressed in transitions:
+                if pressed:
+                    self.level.press_key(key)
+                else:
+                    self.level.release_key(key)
+
+    def load_state(self):
+        """Resets the level directly"""
+        with self.mutex:
+            self.sync()
+            self.level.reset()
+        return True
+
+    def save_state(self):
+        """Captures the level state"""
+        with self.mutex:
+            self.sync()
+            return self.level.get_state()
+
+    def restore_state(self, state):
+        """Restores the level state"""
+        with self.mutex:
+            self.sync()
+            self.level.set_state(state)
+        return True
+
+    def clock(self):
+        """Obtains the simulated time in seconds"""
+        return (time.time() - self.started) * self.speed
+
+    def sleep(self, seconds):
+        """Waits for an amount of simulated time"""
+        time.sleep(seconds / self.speed)
+
+    def close(self):
+        """Stops the REST server and its watch streams"""
+        self.closed.set()
+        super(SimulatedBackend, self).close()
+        self.server.shutdown()
+        self.server.server_close()
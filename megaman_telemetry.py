@@ -0,0 +1,227 @@
+"""Per-run telemetry log and NumPy analysis of it
+
+Usage: megaman_telemetry.py <telemetry.mmxt>
+"""
+
+import mmap
+import os
+import Queue
+import struct
+import sys
+import threading
+from array import array
+
+import numpy as np
+
+from megaman_archive import GenerationArchive, scan_records, truncate_torn
+from megaman_genetics import gather_ranges
+
+class TelemetryLog(object):
+    """Append-only log of every run, one columnar record per run
+
+    Each tick of a run appends a row to in-memory columns: seconds since the
+    run started, X, Y, health and a bitmask of the MegamanAction values fired.
+    When the run ends its columns are packed into a record that a writer
+    thread appends and flushes, so the frame loop never touches the file.
+    """
+
+    MAGIC = 'MMXTELE\0'
+    VERSION = 1
+    HEADER = GenerationArchive.HEADER
+    RECORD_MAGIC = 'RUNR'
+    # magic, generation, test, life, rows, fitness, time, size
+    RECORD = struct.Struct('<4sIIIIddQ4x')
+    # Ordered by item size so each column stays aligned
+    COLUMNS = (('time', 'f'), ('x', 'H'), ('y', 'H'), ('actions', 'H'), ('health', 'B'))
+
+    def __init__(self, filename):
+        """Constructor, creates the file if it doesn't exist
+
+        A run torn by a crash is cut off, so new runs follow the last whole one.
+        """
+        self.filename = filename
+        if not os.path.exists(filename) or not os.path.getsize(filename):
+            with open(filename, 'wb') as writefile:
+                writefile.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0))
+        else:
+            with open(filename, 'rb') as readfile:
+                data = mmap.mmap(readfile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                _, end = scan_records(data, self.RECORD, self.RECORD_MAGIC)
+            finally:
+                data.close()
+            truncate_torn(filename, end)
+        self.columns = self.empty_columns()
+        self.pending = Queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def empty_columns(self):
+        """Obtains a new set of empty columns"""
+        return tuple(array(typecode) for _, typecode in self.COLUMNS)
+
+    def record(self, elapsed_time, x_position, y_position, actions, health):
+        """Appends a tick's row to the current run"""
+        times, xs, ys, fired, healths = self.columns
+        times.append(elapsed_time)
+        xs.append(x_position)
+        ys.append(y_position)
+        fired.append(actions)
+        healths.append(health)
+
+    def fired(self, actions):
+        """Adds a bitmask of fired actions to the current run's last row"""
+        fired = self.columns[3]
+        if fired:
+            fired[-1] |= actions
+
+    def mark(self):
+        """Obtains a copy of the current run's rows, for restore()"""
+        return tuple(array(column.typecode, column) for column in self.columns)
+
+    def restore(self, columns):
+        """Replaces the current run's rows with a copy from mark()"""
+        self.columns = tuple(array(column.typecode, column) for column in columns)
+
+    def finish_run(self, generation, test, fitness, elapsed_time, life):
+        """Queues the current run's record and starts a new run"""
+        columns = self.columns
+        self.columns = self.empty_columns()
+        self.pending.put((generation, test, fitness, elapsed_time, life, columns))
+
+    @classmethod
+    def pack(cls, generation, test, fitness, elapsed_time, life, columns):
+        """Packs a run into a record, padded to 8 bytes"""
+        payload = ''.join(GenerationArchive.little_endian(column) for column in columns)
+        size = (cls.RECORD.size + len(payload) + 7) // 8 * 8
+        header = cls.RECORD.pack(cls.RECORD_MAGIC, generation, test, life, len(columns[0]),
+                                 fitness, elapsed_time, size)
+        return header + payload + '\0' * (size - len(header) - len(payload))
+
+    def write_loop(self):
+        """Writer thread, appends each queued run"""
+        with open(self.filename, 'ab') as writefile:
+            while True:
+                run = self.pending.get()
+                try:
+                    if run is None:
+                        return
+                    writefile.write(self.pack(*run))
+                    # Only flush once the queue has drained
+                    if self.pending.empty():
+                        writefile.flush()
+                finally:
+                    self.pending.task_done()
+
+    def close(self):
+        """Writes every queued run and stops the writer"""
+        self.pending.put(None)
+        self.writer.join()
+
+class TelemetryReader(object):
+    """Memory-mapped view of a telemetry log
+
+    Per-run values are gathered into arrays up front; each run's columns are
+    NumPy views straight onto the map, so nothing is replayed or copied.
+    """
+    DTYPES = {'f': '<f4', 'H': '<u2', 'B': 'u1'}
+
+    def __init__(self, filename):
+        """Constructor"""
+        with open(filename, 'rb') as readfile:
+            self.data = mmap.mmap(readfile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = TelemetryLog.HEADER.unpack_from(self.data, 0)
+        if magic != TelemetryLog.MAGIC or version > TelemetryLog.VERSION:
+            raise ValueError(filename + " is not a readable telemetry log")
+        records, _ = scan_records(self.data, TelemetryLog.RECORD, TelemetryLog.RECORD_MAGIC)
+        offsets = [offset for offset, _ in records]
+        fields = np.array([record[1:7] for _, record in records],
+                          dtype=np.float64).reshape(-1, 6)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.generation = fields[:, 0].astype(np.int64)
+        self.test = fields[:, 1].astype(np.int64)
+        self.life = fields[:, 2].astype(np.int64)
+        self.rows = fields[:, 3].astype(np.int64)
+        self.fitness = fields[:, 4]
+        self.time = fields[:, 5]
+        # Byte offset of every column in every run
+        self.column_starts = {}
+        starts = self.offsets + TelemetryLog.RECORD.size
+        for name, typecode in TelemetryLog.COLUMNS:
+            self.column_starts[name] = starts
+            starts = starts + self.rows * array(typecode).itemsize
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def column(self, run, name):
+        """Obtains a run's column as a view onto the map"""
+        typecode = dict(TelemetryLog.COLUMNS)[name]
+        return np.frombuffer(self.data, dtype=self.DTYPES[typecode],
+                             count=int(self.rows[run]),
+                             offset=int(self.column_starts[name][run]))
+
+    def final(self, name):
+        """Obtains the last row's value of a column for every run with rows"""
+        typecode = dict(TelemetryLog.COLUMNS)[name]
+        itemsize = array(typecode).itemsize
+        runs = np.nonzero(self.rows)[0]
+        starts = self.column_starts[name][runs] + (self.rows[runs] - 1) * itemsize
+        raw = np.frombuffer(self.data, dtype=np.uint8)
+        # Gather each run's last item's bytes, then view them as the column type
+        indices = starts[:, np.newaxis] + np.arange(itemsize)
+        values = np.ascontiguousarray(raw[indices]).view(self.DTYPES[typecode]).ravel()
+        result = np.zeros(len(self), dtype=values.dtype)
+        result[runs] = values
+        return result
+
+    def furthest(self):
+        """Obtains the furthest X each run reached, 0 for runs without rows"""
+        runs = np.nonzero(self.rows)[0]
+        result = np.zeros(len(self), dtype=np.int64)
+        if not len(runs):
+            return result
+        # X columns start on even bytes, so the map is read as 2-byte words
+        words = np.frombuffer(self.data, dtype='<u2', count=len(self.data) // 2)
+        lengths = self.rows[runs]
+        xs = words[gather_ranges(self.column_starts['x'][runs] // 2, lengths)]
+        starts = np.cumsum(lengths) - lengths
+        result[runs] = np.maximum.reduceat(xs, starts)
+        return result
+
+    def fitness_distribution(self, percents=(0, 25, 50, 75, 100)):
+        """Obtains {generation: fitness percentiles} over every run"""
+        order = np.argsort(self.generation, kind='mergesort')
+        generations, starts = np.unique(self.generation[order], return_index=True)
+        groups = np.split(self.fitness[order], starts[1:])
+        return dict((int(generation), np.percentile(group, percents))
+                    for generation, group in zip(generations, groups))
+
+    def death_locations(self, bin_width=100):
+        """Obtains (bin starts, counts) of where runs that died ended"""
+        died = self.final('health') == 0
+        positions = self.final('x')[died & (self.rows > 0)].astype(np.int64)
+        if not len(positions):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        counts = np.bincount(positions // bin_width)
+        bins = np.nonzero(counts)[0]
+        return bins * bin_width, counts[bins]
+
+    def alternative_fitness(self, distance=1.0, health=0.0, time=0.0):
+        """Scores every run by a weighted sum of furthest X, final health and time"""
+        return (distance * self.furthest() + health * self.final('health') -
+                time * self.time)
+
+    def close(self):
+        """Unmaps the log"""
+        self.data.close()
+
+if __name__ == "__main__":
+    READER = TelemetryReader(sys.argv[1])
+    print str(len(READER)) + " runs"
+    for GENERATION, PERCENTILES in sorted(READER.fitness_distribution().items()):
+        print ("Generation " + str(GENERATION) + " fitness min/25/50/75/max: " +
+               "/".join(str(int(value)) for value in PERCENTILES))
+    for POSITION, COUNT in zip(*READER.death_locations()):
+        print "Died near " + str(POSITION) + ": " + str(COUNT)